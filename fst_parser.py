@@ -13,10 +13,18 @@
 This is __doc__
 """
 import sys, os, glob
-from datetime import datetime
-from parsers.file_parsers import toDateTime, FstParser
+from datetime import datetime, timedelta
+from parsers.file_parsers import FstParser, TimeConverter, estimateCount
 from parsers.dict_parsers import load_dictionary_csv, load_dictionary_json
-from parsers.dict_parsers import search_for_message, search_for_direction, search_for_pcap_data
+from parsers.writers import write_file_header, write_record_text, write_record_pcap
+from parsers.manifest import Manifest
+from parsers.dedup import RecordDeduplicator
+from parsers.compress import open_output, output_name
+from parsers.sqlite_store import TraceStore
+from parsers.sketches import HeavyHitters
+from parsers.sessions import SessionTracker
+from parsers.payloads import PayloadTable
+from parsers.work_queue import WorkQueue, merge_results
 import parsers.pcap
 
 
@@ -44,12 +52,38 @@ if __name__ == "__main__":
     saveMessageRawData = True
     decodeMessages = True
     saveToPcapFile = False   # If you set it True then decodeRecordsContent and saveMessageRawData also has to be True
+    pcapEncapsulation = 'ethernet'   # 'ethernet' - Ethernet/IP/SCTP/UDP (needs plugins/zte_fst.lua), 'exported_pdu' - lean Wireshark Upper PDU
+    outputCompression = None  # Compression of decoded text and pcap files: None, 'gzip', 'zstd' or 'lz4' (zstd/lz4 need zstandard/lz4 packages)
+    timezone = 10800  # Time zone of FST times: seconds from UTC (10800 = GMT+3) or time zone name like 'Europe/Moscow'
     dirDecodedFiles = os.path.dirname(source)
     dirPcapFiles = os.path.join(os.path.dirname(source), 'pcap')
     # filterByImsi = ['000000000000000']
     filterByImsi = []
+    deduplicateRecords = False  # Drop records repeated in overlapping or re-sent files
+    dedupWindow = 3600  # Seconds of trace time during which records are remembered for deduplication
+    samplingMode = None  # None - all records, 'nth' - every samplingRate-th record, 'random' - samplingRate fraction, 'imsi' - samplingRate fraction of subscribers
+    samplingRate = 1
+    recoverCorruptedRecords = False  # Resynchronize on the next valid record after corrupted/truncated data instead of decoding garbage
     tsn = 0  # May be used for uniq TSN generation in SCCP messages in pcap
     ssn = 0  # May be used for uniq SSN generation in SCCP messages in pcap
+    saveToSqlite = False  # Load records and messages into SQLite database sqliteFile (decodeRecordsContent and saveMessageRawData should be True)
+    sqliteFile = os.path.join(dirDecodedFiles, 'fst_trace.db')
+    heavyHitters = False  # Find top IMSIs and cells by messages and bytes with count-min sketch and space-saving top-K
+    heavyHittersTopK = 20
+    heavyHittersReportEvery = 0  # Print top-K report every N records (0 - only at the end)
+    heavyHittersFile = os.path.join(dirDecodedFiles, 'fst_heavy_hitters.json')  # Saved state, can be merged with results of other runs by HeavyHitters.load()/merge()
+    trackSessions = False  # Group records into calls/sessions by GlobalCallId and write session summaries to sessionsFile (decodeRecordsContent should be True)
+    sessionTimeout = 600  # Seconds of trace time without records after which a session without UE End is finished
+    sessionsFile = os.path.join(dirDecodedFiles, 'fst_sessions.csv')
+    saveSessionPcap = False  # Write one pcap-file per session to dirPcapFiles (saveMessageRawData should be True)
+    internPayloads = False  # Share identical message payloads of the records kept in memory for session pcap-files (saveSessionPcap)
+    referencePayloads = False  # Write every distinct raw data once per decoded file, repeats as @<record>.<message> of the first occurrence
+    workQueue = False  # Several nodes process the same directory: every file is claimed by a lease file in workQueueDir (shared storage)
+    workQueueDir = os.path.join(dirDecodedFiles, 'fst_queue')
+    leaseTimeout = 600  # Seconds after which files leased by a dead node are processed by other nodes
+    globalStatsFile = os.path.join(dirDecodedFiles, 'fst_global_stats.csv')  # Merged statistics of all nodes, written when all files are done
+    useManifest = True  # Skip files which were already fully processed with the same settings
+    manifestFile = os.path.join(dirDecodedFiles, 'fst_manifest.json')
     # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
 
     if not os.path.exists(dirDecodedFiles):
@@ -66,6 +100,11 @@ if __name__ == "__main__":
             print('Error: Directory for pcap files ' + dirDecodedFiles + ' does not exist!')
             exit()
 
+    if trackSessions and not decodeRecordsContent:
+        # Message times are the clock of the session timeouts, without them sessions are never evicted
+        print('Error: trackSessions requires decodeRecordsContent = True!')
+        exit()
+
     # Load Dictionary
     cwd = os.getcwd()
     dict_messages = load_dictionary_csv(os.path.join(cwd, 'dicts', 'messages.csv'), ['protocolType','procedureType','messageType'])
@@ -73,6 +112,74 @@ if __name__ == "__main__":
     dict_directions_2g = load_dictionary_csv(os.path.join(cwd, 'dicts', 'directions_2g.csv'), ['id'])
     dict_protocols = load_dictionary_json(os.path.join(cwd, 'dicts', 'protocols.json'))
     dict_pcap = load_dictionary_json(os.path.join(cwd, 'dicts', 'protocols_pcap.json'))
+    encapsulations = parsers.pcap.EncapsulationTable(dict_pcap)
+    dictionaries = {'messages': dict_messages, 'protocols': dict_protocols,
+                    'directions_2g': dict_directions_2g, 'directions_3g': dict_directions_3g}
+
+    if workQueue:
+        useManifest = False  # Completion records of the work queue are used instead of the manifest
+        queue = WorkQueue(workQueueDir, leaseTimeout)
+
+    manifest = Manifest()
+    if useManifest:
+        manifest.open(manifestFile)
+    settings = {'decodeRecordsContent': decodeRecordsContent, 'saveMessageRawData': saveMessageRawData,
+                'decodeMessages': decodeMessages, 'saveToPcapFile': saveToPcapFile,
+                'pcapEncapsulation': pcapEncapsulation, 'outputCompression': outputCompression,
+                'timezone': timezone, 'saveToSqlite': saveToSqlite,
+                'dirDecodedFiles': os.path.abspath(dirDecodedFiles), 'dirPcapFiles': os.path.abspath(dirPcapFiles),
+                'filterByImsi': sorted(filterByImsi), 'recoverCorruptedRecords': recoverCorruptedRecords,
+                'deduplicateRecords': deduplicateRecords, 'dedupWindow': dedupWindow, 'samplingMode': samplingMode, 'samplingRate': samplingRate,
+                'referencePayloads': referencePayloads, 'heavyHitters': heavyHitters,
+                'trackSessions': trackSessions, 'sessionTimeout': sessionTimeout}
+
+    timeConverter = TimeConverter(timezone)
+    deduplicator = RecordDeduplicator(dedupWindow)
+    files.sort()  # Process files in time order (file names contain timestamps), so overlaps are found within dedupWindow
+    dedupSkipped = list()  # (file, FileEndTimestamp) of files skipped by the manifest, read into the dedup window when needed
+
+    sampling = {'records': 0, 'sampled': 0}
+    # Interning saves memory only for records kept in memory, records written one by one are freed anyway
+    internTable = PayloadTable() if internPayloads and trackSessions and saveSessionPcap else None
+    referenceTable = PayloadTable() if referencePayloads else None
+    decodedSize = 0
+    if saveToSqlite:
+        traceStore = TraceStore(dictionaries, timeConverter)
+        traceStore.open(sqliteFile)
+    if heavyHitters:
+        hitters = HeavyHitters(heavyHittersTopK)
+        if os.path.exists(heavyHittersFile):
+            # Results of earlier runs are kept, files skipped by the manifest are already counted there
+            try:
+                hitters.merge(HeavyHitters.load(heavyHittersFile))
+            except (ValueError, KeyError, OSError) as e:
+                print('!!!!!!! WARNING !!!!!!!\nHeavy hitters file {0} can not be loaded ({1}) and will be rebuilt\n!!!!!!! WARNING !!!!!!!'.format(
+                    heavyHittersFile, e))
+                hitters = HeavyHitters(heavyHittersTopK)
+    if trackSessions:
+        sessionTracker = SessionTracker(sessionTimeout, saveSessionPcap)
+        protocolNames = {protocol['protocolType']: protocol['protocolName'] for protocol in dict_protocols}
+        # Sessions of all runs are kept, files skipped by the manifest are not tracked again
+        newSessionsFile = not os.path.exists(sessionsFile) or os.path.getsize(sessionsFile) == 0
+        sessions_file = open(sessionsFile, 'a')
+        if newSessionsFile:
+            print('GlobalCallId,Imsi,start,end,duration,records,messages,protocols,cells,reason', file=sessions_file)
+
+        def write_session(session):
+            print('{0},{1},{2},{3},{4:.3f},{5},{6},{7},{8},{9}'.format(session['GlobalCallId'], session['imsi'],
+                    timeConverter.toText(session['start'] // 1000, session['start'] % 1000 // 4) if session['start'] != None else '',
+                    timeConverter.toText(session['end'] // 1000, session['end'] % 1000 // 4) if session['end'] != None else '',
+                    session['duration'], session['records'], session['messages'],
+                    ' '.join('{0}:{1}'.format(protocolNames.get(protocolType, protocolType), count) for protocolType, count in sorted(session['protocols'].items())),
+                    ' '.join(str(cell) for cell in session['cells']), session['reason']), file=sessions_file)
+            if saveSessionPcap:
+                p = parsers.pcap.Pcap(pcapEncapsulation)
+                # Start time and number keep names unique when a key has several sessions (restart, timeout, IMSI key)
+                p.open(os.path.join(dirPcapFiles, '{0}_{1}_{2}_{3}_session.pcap'.format(session['imsi'], session['GlobalCallId'],
+                        session['start'] if session['start'] != None else 0, session['number'])), 0, 0, outputCompression)
+                for record in session['recordList']:
+                    write_record_pcap(p, record, encapsulations, timeConverter)
+                p.close()
 
     # Debugging !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
     missed_messages = list()
@@ -80,59 +187,75 @@ if __name__ == "__main__":
     for msg in dict_messages_count:
         msg['count'] = 0
         msg['total_length'] = 0
+        msg['imsi_counts'] = dict()  # Only for 'imsi' sampling, errors of the estimated counts
     # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
 
-    for source_file in files:
-        # Start file parsing
-        source_file_name = os.path.basename(source_file)
-        print('File: ' + source_file)
-        print('\t{0} Start parsing...'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        ssn +=1
-        tsn = 0
-        fstParser = FstParser()
-        fileIinfo = fstParser.open(source_file)
-        # Start writing decoded data to text file
-        with open(os.path.join(dirDecodedFiles, source_file_name + '.decoded.txt'), 'w') as out_file:
-            print('-'*80, file=out_file)
-            print('FILE HEADER', file=out_file)
-            print('\tElement ID: ' + str(fileIinfo['ElementId']), file=out_file)
-            print('\tElement Mode: ' + str(fileIinfo['ElementMode']), file=out_file)
-            print('\tFile type: ' + str(fileIinfo['FileType']), file=out_file)
-            print('\tElement version: '+ fileIinfo['ElementVersion'], file=out_file)
-            print('\tFile start timestamp: ' + str(fileIinfo['FileStartTimestamp']), file=out_file)
-            print('\tFile end timestamp: ' + str(fileIinfo['FileEndTimestamp']), file=out_file)
-            print('\tFile record number: ' + str(fileIinfo['FileRecordNumber']), file=out_file)
-            print('\tFile No: ' + str(fileIinfo['FileNo']), file=out_file)
-
-            if fileIinfo['FileRecordNumber'] > 0:
-                rec = 0
-                # Read all records wich fulfill filterByImsi criterias one by one
-                for record in fstParser.readRecords(decodeRecordsContent, saveMessageRawData, filterByImsi):
-                    # pprint(record)
-                    print('\nDATA RECORD ' + str(rec), file=out_file)
-                    print('\tRecord length: ' + str(record['recordLength']), file=out_file)
-                    print('\t\tRecord Header: ', file=out_file)
-                    print('\t\t\tUE ID Info: ', file=out_file)
-                    print('\t\t\t\tGlobal Call ID: ' + str(record['recordHeader']['ueIdInfo']['GlobalCallId']), file=out_file)
-                    print('\t\t\t\tIMSI Information: ', file=out_file)
-                    print('\t\t\t\t\tIMSI Length: ' + str(record['recordHeader']['ueIdInfo']['ImsiLength']), file=out_file)
-                    print('\t\t\t\t\tAccess Cell ID: ' + str(record['recordHeader']['ueIdInfo']['AccessCellId']), file=out_file)
-                    print('\t\t\t\t\tIMSI Element: ' + str(record['recordHeader']['ueIdInfo']['ImsiElement']), file=out_file)
-                    print('\t\t\tSource ID: ' + str(record['recordHeader']['SourceId']), file=out_file)
-                    print('\t\t\tRecord type: ' + str(record['recordHeader']['RecordType']), file=out_file)
-                    print('\t\t\tRecord TLV data length: ' + str(record['recordHeader']['RecordTlvDataLength']), file=out_file)
-                    if record['recordHeader']['RecordTlvDataLength'] > 0:
-                        print('\t\t\tRecord TLV data: ' + record['recordTlvData'], file=out_file)
-                    print('\t\t\tMessage count: ' + str(record['recordHeader']['MessageCount']), file=out_file)
-                    print('\t\t\tRecord content length: ' + str(record['recordHeader']['RecordContentLength']), file=out_file)
-                    print('\t\t\tRecord sequence: ' + str(record['recordHeader']['RecordSequence']), file=out_file)
-
-                    if decodeRecordsContent:
-                        for message in record['recordContent']:
-                            msg = search_for_message(dict_messages, dict_protocols, message['header']['protocolType'],
-                                                    message['header']['procedureType'], message['header']['messageType'])
-
-                            # Debugging !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+    for source_file in (queue.claim_next(files) if workQueue else files):
+        try:
+            # Start file parsing
+            source_file_name = os.path.basename(source_file)
+            print('File: ' + source_file)
+            print('\t{0} Start parsing...'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            ssn +=1
+            tsn = 0
+            fstParser = FstParser()
+            fileIinfo = fstParser.open(source_file)
+            if useManifest:
+                signature = manifest.signature(source_file, fileIinfo)
+                if manifest.is_processed(source_file, signature, settings):
+                    fstParser.close()
+                    if deduplicateRecords:
+                        dedupSkipped.append((source_file, fileIinfo['FileEndTimestamp']))
+                    print('\t{0} Already processed, skipped'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                    continue
+                manifest.mark_started(source_file, signature, settings)
+            if deduplicateRecords and len(dedupSkipped) > 0:
+                # Records of skipped files may be re-sent in this file, the files inside the window are read without output
+                for skipped_file, skippedEnd in dedupSkipped:
+                    if skippedEnd >= fileIinfo['FileStartTimestamp'] - timedelta(seconds=dedupWindow):
+                        skippedParser = FstParser()
+                        skippedInfo = skippedParser.open(skipped_file)
+                        skippedParser.setSampling(samplingMode, samplingRate, seed=skippedInfo['FileNo'])
+                        deduplicator.remember(skippedParser.readRecords(decodeRecordsContent, saveMessageRawData, filterByImsi, recoverCorruptedRecords))
+                        skippedParser.close()
+                dedupSkipped.clear()
+            fstParser.setSampling(samplingMode, samplingRate, seed=fileIinfo['FileNo'])
+            if workQueue:
+                countsBefore = [(msg['count'], msg['total_length']) for msg in dict_messages_count]
+                missedBefore = {(msg['protocolType'], msg['procedureType'], msg['messageType']): msg['count'] for msg in missed_messages}
+            fstParser.setPayloadTable(internTable)
+            if referencePayloads:
+                referenceTable.reset_references()
+            outputs = list()
+            pcapCount = 0
+            pcapSize = 0
+            # Start writing decoded data to text file
+            decoded_file = os.path.join(dirDecodedFiles, source_file_name + '.decoded.txt')
+            outputs.append(output_name(decoded_file, outputCompression))
+            if saveToSqlite:
+                traceStore.begin_file(os.path.abspath(source_file), fileIinfo)
+            with open_output(decoded_file, outputCompression, text=True) as out_file:
+                write_file_header(out_file, fileIinfo)
+
+                if fileIinfo['FileRecordNumber'] > 0:
+                    rec = 0
+                    # Read all records wich fulfill filterByImsi criterias one by one
+                    records = fstParser.readRecords(decodeRecordsContent, saveMessageRawData, filterByImsi, recoverCorruptedRecords)
+                    if deduplicateRecords:
+                        records = deduplicator.filter(records)
+                    if heavyHitters and os.path.abspath(source_file) not in hitters.files:
+                        hitters.files.add(os.path.abspath(source_file))
+                        records = hitters.feed(records, heavyHittersReportEvery, heavyHittersTopK)
+                    if trackSessions:
+                        records = sessionTracker.track(records, write_session)
+                    for record in records:
+                        # pprint(record)
+                        msgs = write_record_text(out_file, rec, record, fileIinfo['ElementMode'], dictionaries,
+                                                 decodeRecordsContent, saveMessageRawData, timeConverter,
+                                                 referenceTable)
+
+                        # Debugging !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+                        for message, msg in zip(record['recordContent'], msgs):
                             if msg['messageName'] == '':
                                 new_msg = True
                                 for missed_msg in missed_messages:
@@ -154,72 +277,116 @@ if __name__ == "__main__":
                                             msg_['messageType'] == message['header']['messageType']):
                                         msg_['count'] += 1
                                         msg_['total_length'] += message['header']['rawDataLength']
+                                        if samplingMode == 'imsi':
+                                            imsi = record['recordHeader']['ueIdInfo']['ImsiElement']
+                                            msg_['imsi_counts'][imsi] = msg_['imsi_counts'].get(imsi, 0) + 1
                                         break
-                            # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
-
-                            print('\t\t\t\tMessage: ', file=out_file)
-                            print('\t\t\t\t\tMessage header: ', file=out_file)
-                            print('\t\t\t\t\t\tProtocol type: ' + str(message['header']['protocolType']) + ' ' + msg['protocolName'], file=out_file)
-                            print('\t\t\t\t\t\tProcedure type: ' + str(message['header']['procedureType'])  + ' ' + msg['procedureName'], file=out_file)
-                            print('\t\t\t\t\t\tMessage type: ' + str(message['header']['messageType'])   + ' ' + msg['messageName'], file=out_file)
-                            if fileIinfo['ElementMode'] == 3:   # 3 - GSM
-                                print('\t\t\t\t\t\tDirection: ' + str(message['header']['direction']) + ' ' + search_for_direction(dict_directions_2g, message['header']['direction']), file=out_file)
-                            elif fileIinfo['ElementMode'] == 1: # 1 - UMTS
-                                print('\t\t\t\t\t\tDirection: ' + str(message['header']['direction']) + ' ' + search_for_direction(dict_directions_3g, message['header']['direction']), file=out_file)
-                            print('\t\t\t\t\t\tSecond: ' + str(toDateTime(seconds=message['header']['second'], milliseconds=message['header']['quatMillisecond']*4)), file=out_file)  #01.01.2000
-                            print('\t\t\t\t\t\tService Cell ID: ' + str(message['header']['serviceCellId']), file=out_file)
-                            print('\t\t\t\t\t\tMessage TLV data length: ' + str(message['header']['messageTlvDataLength']), file=out_file)
-                            if message['header']['messageTlvDataLength'] > 0:
-                                print('\t\t\t\t\t\tMessage TLV data: ' + message['tlvData'], file=out_file)
-                            print('\t\t\t\t\t\tMessage sequence: ' + str(message['header']['messageSequence']), file=out_file)
-                            print('\t\t\t\t\t\tRaw data length: ' + str(message['header']['rawDataLength']), file=out_file)
-                            if saveMessageRawData:
-                                print('\t\t\t\t\t\tRaw data: ' + message['rawData'], file=out_file)
-                    else:
-                        print('\t\t\tRecord Raw data: ' + record['recordRawContent'], file=out_file)
-                    print('-'*80, file=out_file)
-
-                    # Save to PCAP-file
-                    if saveToPcapFile and decodeRecordsContent and saveMessageRawData:
-                        tsn += 500
-                        p = parsers.pcap.Pcap()
-                        p.open(os.path.join(dirPcapFiles, '{0}_{1:06}_{2}.pcap'.format(str(record['recordHeader']['ueIdInfo']['ImsiElement']), rec, source_file_name)), tsn, ssn)
-                        for message in record['recordContent']:
-                            # Find proper Wireshark desector for message
-                            if message['header']['protocolType'] == 100:
-                                pass
-                            elif (message['header']['protocolType'] == 101 or message['header']['protocolType'] == 102
-                                    or message['header']['protocolType'] == 103 or message['header']['protocolType'] == 104
-                                    or message['header']['protocolType'] == 151 or message['header']['protocolType'] == 152
-                                    or message['header']['protocolType'] == 153):
-                                pcap_data = search_for_pcap_data(dict_pcap, message['header']['protocolType'], message['header']['direction'],
-                                        message['header']['procedureType'])
-                            else:
-                                pcap_data = None
-
-                            # Write message to pcap file
-                            if message['header']['protocolType'] != 100:
-                                if pcap_data != None and pcap_data['pcap_data'] != None:
-                                    p.write_message(msg_hex=message['rawData'],
-                                            time=toDateTime(seconds=message['header']['second'], milliseconds=message['header']['quatMillisecond']*4),
-                                            protocol=pcap_data['protocol'],
-                                            pcap_data=pcap_data['pcap_data'])
-                                else:
-                                    raise Exception('Pcap saving exception: Protocol type:{0}, Procedure type:{1}, Message:{2}, Direction:{3}'.format(
-                                        message['header']['protocolType'], message['header']['procedureType'],
-                                        msg['procedureName'], message['header']['direction'])
-                                    )
-                        p.close()
-                    rec += 1
-        print('\t{0} Done'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                        # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+
+                        if saveToSqlite:
+                            traceStore.add_record(rec, record)
+
+                        # Save to PCAP-file
+                        if saveToPcapFile and decodeRecordsContent and saveMessageRawData:
+                            tsn += 500
+                            p = parsers.pcap.Pcap(pcapEncapsulation)
+                            pcap_file = os.path.join(dirPcapFiles, '{0}_{1:06}_{2}.pcap'.format(str(record['recordHeader']['ueIdInfo']['ImsiElement']), rec, source_file_name))
+                            p.open(pcap_file, tsn, ssn, outputCompression)
+                            write_record_pcap(p, record, encapsulations, timeConverter)
+                            p.close()
+                            pcapCount += 1
+                            if useManifest:
+                                pcapSize += os.path.getsize(output_name(pcap_file, outputCompression))
+                        rec += 1
+            decodedSize += os.path.getsize(output_name(decoded_file, outputCompression))
+            if saveToSqlite:
+                traceStore.end_file()
+            sampling['records'] += fstParser.samplingStats()['records']
+            sampling['sampled'] += fstParser.samplingStats()['sampled']
+            if len(fstParser.skippedRanges()) > 0:
+                print('\tSkipped corrupted byte ranges: ' + ', '.join('{0}-{1}'.format(start, end) for start, end in fstParser.skippedRanges()))
+            fstParser.close()
+            if useManifest:
+                manifest.mark_done(source_file, outputs, pcapCount, pcapSize)
+            if workQueue:
+                # Per-file statistics for the final merge of all nodes
+                result = {'records': fileIinfo['FileRecordNumber'], 'sampling': fstParser.samplingStats(), 'messages': dict(), 'missed': dict()}
+                del result['sampling']['fraction']
+                for msg, (count, total_length) in zip(dict_messages_count, countsBefore):
+                    if msg['count'] > count:
+                        result['messages']['{0},{1},{2}'.format(msg['protocolType'], msg['procedureType'], msg['messageType'])] = {
+                            'count': msg['count'] - count, 'total_length': msg['total_length'] - total_length}
+                for msg in missed_messages:
+                    count = msg['count'] - missedBefore.get((msg['protocolType'], msg['procedureType'], msg['messageType']), 0)
+                    if count > 0:
+                        result['missed']['{0},{1},{2}'.format(msg['protocolType'], msg['procedureType'], msg['messageType'])] = count
+                queue.complete(source_file, result)
+            print('\t{0} Done'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        except:
+            # Give the file back at once, other nodes would wait leaseTimeout after this process exits
+            if workQueue:
+                queue.release(source_file)
+            raise
+
+    if saveToSqlite:
+        traceStore.close()
+    if deduplicateRecords:
+        print('\nDuplicated records removed: {duplicates} of {records}'.format(**deduplicator.report()))
+    if internTable != None:
+        print('\nPayloads of session records: {payloads}, shared: {shared}, interning table: {tableBytes} bytes'.format(**internTable.report()))
+    if referenceTable != None:
+        report = referenceTable.report()
+        print('\nPayloads written as reference: {0}, decoded files: {1} bytes ({2} bytes saved)'.format(
+            report['references'], decodedSize, report['referencedBytes']))
+    if heavyHitters:
+        print('\n' + hitters.format_report(heavyHittersTopK))
+        hitters.save(heavyHittersFile)
+    if trackSessions:
+        for session in sessionTracker.flush():
+            write_session(session)
+        sessions_file.close()
+        print('\nSessions: {finished}'.format(**sessionTracker.stats()))
+
+    if workQueue:
+        status = queue.status(files)
+        if status['done'] == len(files):
+            # Final step: merge completion records of all nodes (every node finishing last writes the same file)
+            merged = merge_results(queue.results(files))
+            tmp_file = '{0}.{1}.tmp'.format(globalStatsFile, os.getpid())
+            with open(tmp_file, 'w') as f:
+                print('protocolType,procedureType,messageType,messageName,count,total_length', file=f)
+                for msg in dict_messages_count:
+                    counts = merged.get('messages', dict()).get('{0},{1},{2}'.format(msg['protocolType'], msg['procedureType'], msg['messageType']),
+                                                                {'count': 0, 'total_length': 0})
+                    print('{0},{1},{2},{3},{4},{5}'.format(msg['protocolType'], msg['procedureType'], msg['messageType'], msg['messageName'],
+                            counts['count'], counts['total_length']), file=f)
+                for key, count in sorted(merged.get('missed', dict()).items()):
+                    print('{0},,{1},'.format(key, count), file=f)
+            os.replace(tmp_file, globalStatsFile)
+            print('\nGlobal statistics of {0} files ({1} records) from {2} nodes: {3}'.format(merged['files'], merged.get('records', 0),
+                    len(merged['nodes']), globalStatsFile))
+        else:
+            print('\nWork queue: {done} files done, {leased} in progress on other nodes, {waiting} waiting'.format(**status))
 
     # Debugging !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
     if len(missed_messages) > 0:
         print('\nThere are missed messages in file(s):')
         print(missed_messages)
-    print('\nprotocolType,procedureType,messageType,messageName,count,total_length')
-    for msg in dict_messages_count:
-        print('{0},{1},{2},{3},{4},{5}'.format(msg['protocolType'], msg['procedureType'], msg['messageType'], msg['messageName'], msg['count'], msg['total_length']))
+    if samplingMode == None:
+        print('\nprotocolType,procedureType,messageType,messageName,count,total_length')
+        for msg in dict_messages_count:
+            print('{0},{1},{2},{3},{4},{5}'.format(msg['protocolType'], msg['procedureType'], msg['messageType'], msg['messageName'], msg['count'], msg['total_length']))
+    else:
+        # Counts are scaled up to all records, error is one standard error of the estimated count
+        # (for 'imsi' sampling computed from per-IMSI counts, as whole subscribers are sampled)
+        fraction = sampling['sampled'] / sampling['records'] if sampling['records'] > 0 else 1
+        print('\nSampled records: {0} of {1} ({2:.4f})'.format(sampling['sampled'], sampling['records'], fraction))
+        print('protocolType,procedureType,messageType,messageName,count,total_length,estimated_count,estimated_count_error,estimated_total_length')
+        for msg in dict_messages_count:
+            estimate, error = estimateCount(msg['count'], fraction,
+                                            sum(c * c for c in msg['imsi_counts'].values()) if samplingMode == 'imsi' else None)
+            print('{0},{1},{2},{3},{4},{5},{6:.0f},{7:.0f},{8:.0f}'.format(msg['protocolType'], msg['procedureType'], msg['messageType'], msg['messageName'],
+                    msg['count'], msg['total_length'], estimate, error, estimateCount(msg['total_length'], fraction)[0]))
     # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
 # END
 
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+#------------------------------------------------------------------------------
+# Name:        Local FST trace query service
+# Purpose:     Answer repeated "pcap for IMSI X over the last hour" queries
+#              without reloading dictionaries and rescanning all files
+#------------------------------------------------------------------------------
+"""
+Long-running local HTTP service over a directory of ZTE FST files.
+
+Dictionaries are loaded once, per-file IMSI/time indexes are kept in memory
+(see parsers.trace_index.TraceIndex) and the directory is polled for new files.
+
+Usage:
+    fst_service.py <trace directory> [port]
+
+Queries (times are in the time zone of the FST files, 'last' is counted back
+from the end of the newest file of the directory):
+    http://127.0.0.1:8765/pcap?imsi=<IMSI>&last=3600
+    http://127.0.0.1:8765/pcap?imsi=<IMSI>&start=2018-09-11 08:00:00&end=2018-09-11 09:00:00
+    http://127.0.0.1:8765/text?imsi=<IMSI>&last=3600
+    http://127.0.0.1:8765/status
+"""
+import sys, os, io, json, time, threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from parsers.file_parsers import FstParser, TimeConverter, toZteSeconds
+from parsers.dict_parsers import load_dictionary_csv, load_dictionary_json
+from parsers.trace_index import TraceIndex
+from parsers.writers import write_file_header, write_record_text, write_record_pcap
+import parsers.pcap
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # Set by the main program
+    traceIndex = None
+    dictionaries = None
+    encapsulations = None
+    pcapEncapsulation = 'ethernet'
+    timeConverter = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            if url.path == '/status':
+                self.__send_headers('application/json')
+                self.wfile.write(json.dumps(self.traceIndex.status()).encode())
+            elif url.path == '/pcap' or url.path == '/text':
+                if 'imsi' not in params:
+                    raise ValueError('Parameter imsi is required')
+                start, end = self.__time_range(params)
+                matches = self.traceIndex.query(params['imsi'], start, end)
+                if url.path == '/pcap':
+                    self.__send_headers('application/vnd.tcpdump.pcap')
+                    self.__stream_pcap(matches)
+                else:
+                    self.__send_headers('text/plain; charset=utf-8')
+                    self.__stream_text(matches)
+            else:
+                self.send_error(404)
+        except ValueError as e:
+            self.send_error(400, str(e))
+
+
+    def __time_range(self, params: dict) -> tuple:
+        start = None
+        end = None
+        if 'last' in params:
+            end = self.traceIndex.latest()
+            if end != None:
+                start = end - int(params['last'])
+        if 'start' in params:
+            start = toZteSeconds(datetime.fromisoformat(params['start']))
+        if 'end' in params:
+            end = toZteSeconds(datetime.fromisoformat(params['end']))
+        return start, end
+
+
+    def __send_headers(self, content_type: str):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.end_headers()
+
+
+    def __stream_pcap(self, matches: list):
+        p = parsers.pcap.Pcap(self.pcapEncapsulation)
+        p.open_stream(self.wfile)
+        for path, records in matches:
+            fstParser = FstParser()
+            fstParser.open(path)
+            try:
+                for rec, offset in records:
+                    try:
+                        write_record_pcap(p, fstParser.readRecordAt(offset), self.encapsulations, self.timeConverter)
+                    except Exception as e:
+                        self.log_message('%s record %d: %s', path, rec, e)
+            finally:
+                fstParser.close()
+        p.close()
+
+
+    def __stream_text(self, matches: list):
+        out_file = io.TextIOWrapper(self.wfile, encoding='utf-8', newline='\n')
+        for path, records in matches:
+            print('File: ' + path, file=out_file)
+            fstParser = FstParser()
+            fileInfo = fstParser.open(path)
+            try:
+                write_file_header(out_file, fileInfo)
+                for rec, offset in records:
+                    write_record_text(out_file, rec, fstParser.readRecordAt(offset), fileInfo['ElementMode'], self.dictionaries,
+                                      timeConverter=self.timeConverter)
+            finally:
+                fstParser.close()
+        out_file.flush()
+        out_file.detach()
+
+
+def watch_directory(traceIndex: TraceIndex, pollInterval: int):
+    while True:
+        time.sleep(pollInterval)
+        for path in traceIndex.refresh():
+            print('{0} New file: {1}'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), path))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        source = sys.argv[1].strip()
+    else:
+        source = input('Please enter full path to trace directory:').strip()
+
+    if not os.path.isdir(source):
+        print('Error: Directory ' + source + ' does not exist!')
+        exit()
+
+    # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+    # Configuration parameters
+    # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+    host = '127.0.0.1'   # Listen only on localhost
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+    maxIndexedFiles = 300   # Per-file indexes kept in memory (a day of 5-minute files)
+    pollInterval = 10   # Seconds between trace directory rescans
+    QueryHandler.pcapEncapsulation = 'ethernet'   # 'ethernet' (needs plugins/zte_fst.lua) or 'exported_pdu'
+    QueryHandler.timeConverter = TimeConverter(10800)   # Time zone of FST times: seconds from UTC (10800 = GMT+3) or name like 'Europe/Moscow'
+    # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+
+    # Load Dictionary
+    cwd = os.getcwd()
+    QueryHandler.dictionaries = {
+        'messages': load_dictionary_csv(os.path.join(cwd, 'dicts', 'messages.csv'), ['protocolType','procedureType','messageType']),
+        'protocols': load_dictionary_json(os.path.join(cwd, 'dicts', 'protocols.json')),
+        'directions_2g': load_dictionary_csv(os.path.join(cwd, 'dicts', 'directions_2g.csv'), ['id']),
+        'directions_3g': load_dictionary_csv(os.path.join(cwd, 'dicts', 'directions_3g.csv'), ['id'])}
+    QueryHandler.encapsulations = parsers.pcap.EncapsulationTable(load_dictionary_json(os.path.join(cwd, 'dicts', 'protocols_pcap.json')))
+
+    print('{0} Indexing {1}...'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), source))
+    QueryHandler.traceIndex = TraceIndex(source, maxIndexedFiles)
+    QueryHandler.traceIndex.refresh()
+    print('{0} Indexed: {1}'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), QueryHandler.traceIndex.status()))
+
+    threading.Thread(target=watch_directory, args=(QueryHandler.traceIndex, pollInterval), daemon=True).start()
+
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    print('Listening on http://{0}:{1}/'.format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+# END
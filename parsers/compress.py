@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+This module contains the class for writing compressed output files (decoded text
+and pcap). Compression runs in a background thread, so it overlaps decoding
+"""
+import io
+import zlib
+import queue
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+#File name extension for every supported compression
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst', 'lz4': '.lz4'}
+
+
+def available_compressions() -> list:
+    """
+    Returns
+    -------
+    list
+        Compressions which can be used in this environment
+    """
+
+    result = ['gzip']
+    if zstandard != None:
+        result.append('zstd')
+    if lz4 != None:
+        result.append('lz4')
+    return result
+
+
+def open_output(filename: str, compression = None, text = False, level = None, chunkSize = 1 << 20):
+    """
+    Open output file, compressed if required
+
+    Parameters
+    ----------
+    filename: str
+        Full path to the file. For compressed file the extension from EXTENSIONS
+        is added, see output_name()
+
+    compression = None
+        None, 'gzip', 'zstd' or 'lz4'
+
+    text = False
+        Open for writing str (True) or bytes (False)
+
+    level = None
+        Compression level, None means default level of the compression
+
+    chunkSize = 1 << 20
+        Size of the data compressed at once in the background thread
+
+    Returns
+    -------
+    File object (CompressedWriter with buffering and text encoding if required)
+    """
+
+    if compression == None:
+        return open(filename, 'w' if text else 'wb')
+    f = io.BufferedWriter(CompressedWriter(output_name(filename, compression), compression, level), buffer_size=chunkSize)
+    if text:
+        f = io.TextIOWrapper(f)
+    return f
+
+
+def output_name(filename: str, compression = None) -> str:
+    if compression == None:
+        return filename
+    return filename + EXTENSIONS[compression]
+
+
+class _Compressor:
+    #The same compress()/flush() interface for all compressions
+
+    def __init__(self, compression: str, level):
+        self.__header = b''
+        if compression == 'gzip':
+            self.__c = zlib.compressobj(6 if level == None else level, zlib.DEFLATED, 31)   #31 - gzip container
+        elif compression == 'zstd':
+            if zstandard == None:
+                raise ValueError('Compression zstd requires zstandard package')
+            self.__c = zstandard.ZstdCompressor(level=3 if level == None else level).compressobj()
+        elif compression == 'lz4':
+            if lz4 == None:
+                raise ValueError('Compression lz4 requires lz4 package')
+            self.__c = lz4.frame.LZ4FrameCompressor(compression_level=0 if level == None else level)
+            self.__header = self.__c.begin()   #lz4 frame header
+        else:
+            raise ValueError('Unknown compression: ' + str(compression))
+
+
+    def compress(self, data: bytes) -> bytes:
+        header, self.__header = self.__header, b''
+        return header + self.__c.compress(data)
+
+
+    def flush(self) -> bytes:
+        header, self.__header = self.__header, b''
+        return header + self.__c.flush()
+
+
+class _CompressionWorker:
+    #One background thread shared by all writers. Tasks of every writer are
+    #executed in the order they were queued
+
+    def __init__(self):
+        self.__queue = queue.Queue(maxsize=16)   #Bounds memory if decoding is faster than compression
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+
+    def submit(self, task):
+        with self.__lock:
+            if self.__thread == None or not self.__thread.is_alive():
+                self.__thread = threading.Thread(target=self.__run, name='fst-compression', daemon=True)
+                self.__thread.start()
+        self.__queue.put(task)
+
+
+    def __run(self):
+        while True:
+            task = self.__queue.get()
+            task()
+
+
+_worker = _CompressionWorker()
+
+
+class CompressedWriter(io.RawIOBase):
+    """
+    Raw binary file writer which compresses every written chunk in the background
+    thread. Normally used through open_output(), which adds buffering (and text
+    encoding), so chunks of chunkSize bytes are compressed at once.
+    """
+
+    def __init__(self, filename: str, compression = 'gzip', level = None):
+        super().__init__()
+        self.__file = open(filename, 'wb')
+        self.__compressor = _Compressor(compression, level)
+        self.__error = None
+
+
+    def writable(self) -> bool:
+        return True
+
+
+    def write(self, data) -> int:
+        self.__check_error()
+        chunk = bytes(data)
+        def compress():
+            if self.__error != None:
+                return
+            try:
+                self.__file.write(self.__compressor.compress(chunk))
+            except Exception as e:
+                self.__error = e
+        _worker.submit(compress)
+        return len(chunk)
+
+
+    def close(self):
+        if not self.closed:
+            #Wait until all queued chunks are written, so the file is complete after close()
+            done = threading.Event()
+            def finish():
+                try:
+                    if self.__error == None:
+                        self.__file.write(self.__compressor.flush())
+                    self.__file.close()
+                except Exception as e:
+                    self.__error = e
+                done.set()
+            _worker.submit(finish)
+            done.wait()
+            super().close()
+            self.__check_error()
+
+
+    def __check_error(self):
+        if self.__error != None:
+            raise self.__error
+
+
+if __name__ == '__main__':
+    print('Module compress.py is not main application')
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+This module contains the class for removing duplicated data records which appear
+in overlapping or re-sent FST files
+"""
+from collections import deque
+
+
+class RecordDeduplicator:
+    """
+    Time-windowed deduplication of data records
+
+    A record is identified by (GlobalCallId, RecordSequence, SourceId) and by
+    sequence numbers and times of its messages (or by its raw content if
+    records content is not decoded). Keys are remembered only for records not
+    older than window seconds from the newest record seen, so memory is bounded
+    by the traffic of one window whatever the amount of input.
+    """
+
+    def __init__(self, window = 3600):
+        """
+        Parameters
+        ----------
+        window = 3600
+            Seconds of trace time during which a record is remembered. Has to be
+            larger than the maximal overlap of the delivered files
+        """
+
+        self.__window = window
+        self.__seen = set()
+        self.__order = deque()   # (second, key) in order of arrival
+        self.__newest = 0
+        self.__records = 0
+        self.__duplicates = 0
+
+
+    def filter(self, records):
+        """
+        Pass through only the records which were not seen before
+
+        Parameters
+        ----------
+        records:
+            Iterable of data records, e.g. FstParser.readRecords()
+
+        Returns
+        -------
+        dict
+            Yields unique data records
+        """
+
+        for record in records:
+            if not self.is_duplicate(record):
+                yield record
+
+
+    def remember(self, records):
+        """
+        Add records of an already processed file (e.g. skipped as processed in an
+        earlier run) to the window, so their re-sent copies in the following
+        files are found. The records are not counted in report()
+
+        Parameters
+        ----------
+        records:
+            Iterable of data records, e.g. FstParser.readRecords()
+        """
+
+        for record in records:
+            self.__check(record)
+
+
+    def is_duplicate(self, record: dict) -> bool:
+        self.__records += 1
+        if self.__check(record):
+            self.__duplicates += 1
+            return True
+        return False
+
+
+    def __check(self, record: dict) -> bool:
+        #Returns True if the key was seen, remembers the new key otherwise
+        header = record['recordHeader']
+        if len(record['recordContent']) > 0:
+            second = max(message['header']['second'] for message in record['recordContent'])
+            content = hash(tuple((message['header']['messageSequence'], message['header']['second'],
+                                  message['header']['quatMillisecond']) for message in record['recordContent']))
+        else:
+            second = self.__newest
+            content = hash(record['recordRawContent'])
+        key = (header['ueIdInfo']['GlobalCallId'], header['RecordSequence'], header['SourceId'], content)
+
+        if key in self.__seen:
+            return True
+
+        self.__seen.add(key)
+        self.__order.append((second, key))
+        if second > self.__newest:
+            self.__newest = second
+            while self.__order[0][0] < self.__newest - self.__window:
+                self.__seen.discard(self.__order.popleft()[1])
+        return False
+
+
+    def report(self) -> dict:
+        """
+        Returns
+        -------
+        dict
+            {'records': checked records, 'duplicates': removed records,
+             'tracked': keys currently kept in memory}
+        """
+
+        return {'records': self.__records, 'duplicates': self.__duplicates, 'tracked': len(self.__seen)}
+
+
+if __name__ == '__main__':
+    print('Module dedup.py is not main application')
@@ -3,10 +3,16 @@
 This module contains the class and functions for parsing ZTE FST GSM/UMTS files
 """
 import struct
+import mmap
+import math
+import random
+import zlib
 from datetime import datetime
 from datetime import timedelta
+from parsers.payloads import PayloadTable
 
-def parser_umts_gsm(file: str, decodeRecordsContent = True, saveMessageRawData = True, filterByImsi = list()) -> dict:
+def parser_umts_gsm(file: str, decodeRecordsContent = True, saveMessageRawData = True, filterByImsi = list(), batchSize = 0,
+                    internPayloads = False) -> dict:
     """
     Parsing ZTE FST GSM/UMTS file
 
@@ -29,6 +35,19 @@ def parser_umts_gsm(file: str, decodeRecordsContent = True, saveMessageRawData =
         Indicate if it is needed to filter Data Records by IMSIs. If list is empty,
         it means that no filter applied
 
+    batchSize = 0
+        If 0, the whole file is read into 'dataRecords' list.
+        If > 0, the file is read lazily: 'dataRecords' is a generator which yields
+        lists of up to batchSize data records, so memory usage does not depend on
+        the file size. The file is opened again on the first iteration and closed
+        when the generator is exhausted or closed, so nothing stays open if the
+        generator is never iterated
+
+    internPayloads = False
+        Share one str object between identical message payloads of the file, see
+        parsers.payloads.PayloadTable. Used only if the whole file is read
+        (batchSize = 0), batches are small and interning would only add the table
+
     Returns
     -------
     dict
@@ -38,7 +57,8 @@ def parser_umts_gsm(file: str, decodeRecordsContent = True, saveMessageRawData =
                     'FileStartTimestamp', 'FileEndTimestamp', 'FileRecordNumber',
                     'FileNo'}
 
-            'dataRecords': dict, contains data records from the file like:
+            'dataRecords': list (or generator of lists if batchSize > 0), contains
+                    data records from the file like:
                     {'recordLength', 'recordHeader':{ 'ueIdInfo': { 'GlobalCallId',
                             'ImsiLength', 'AccessCellId', 'ImsiElement'
                             },
@@ -58,129 +78,38 @@ def parser_umts_gsm(file: str, decodeRecordsContent = True, saveMessageRawData =
         More detailed information see in the ZTE specificztions mentioned above.
     """
 
-    #Parsing the Binnary File
-    # https://docs.python.org/3/library/struct.html#struct.unpack
-    # https://docs.python.org/3/library/struct.html#struct-format-strings
-    # Byte      - B (1 byte)
-    # WORD16    - H (2 bytes)
-    # WORD32    - L (4 bytes)
-    # WORD64    - Q (8 bytes)
-    # Char[]    - s
-
-    result = {'file': None, 'dataRecords': None}
-
-    with open(file, 'rb') as f:
-        #byte = f.read(36+16)
-        ElementId, ElementMode, FileType, ElementVersion, FileStartTimestamp, FileEndTimestamp, FileRecordNumber, FileNo = struct.unpack('=HBB32sLLLL', f.read(52))
-        ElementVersion = ElementVersion.decode().rstrip('\0')
-        FileStartTimestamp = toDateTime(seconds=FileStartTimestamp)  #01.01.2000
-        FileEndTimestamp = toDateTime(seconds=FileEndTimestamp)  #01.01.2000
-        f.read(28)  #Reserved 28 bytes
-
-        result['file'] = {'ElementId': ElementId, 'ElementMode': ElementMode, 'FileType': FileType, 'ElementVersion': ElementVersion,
-                'FileStartTimestamp': FileStartTimestamp, 'FileEndTimestamp': FileEndTimestamp, 'FileRecordNumber': FileRecordNumber, 'FileNo': FileNo
-        }
-
-        if  FileRecordNumber > 0:
-            dataRecords =list()
-            for rec in range(FileRecordNumber):
-                recordTlvData =''
-                recordRawContent =''
-                messages =list()
-                recordLength, recordHeader_ueIdInfo_GlobalCallId, recordHeader_ueIdInfo_ImsiInformation_ImsiLength = struct.unpack('=HQB', f.read(11))
-                f.read(1)  #Reserved 1 byte
-                recordHeader_ueIdInfo_ImsiInformation_AccessCellId, imsi = struct.unpack('=H8s', f.read(10))
-                recordHeader_ueIdInfo_ImsiInformation_ImsiElement = '{0}{1}{2}{3}{4}{5}{6}{7}{8}{9}{10}{11}{12}{13}{14}'.format(
-                    ('{0:0>2x}'.format(imsi[0]))[0],
-                    ('{0:0>2x}'.format(imsi[1]))[1], ('{0:0>2x}'.format(imsi[1]))[0],
-                    ('{0:0>2x}'.format(imsi[2]))[1], ('{0:0>2x}'.format(imsi[2]))[0],
-                    ('{0:0>2x}'.format(imsi[3]))[1], ('{0:0>2x}'.format(imsi[3]))[0],
-                    ('{0:0>2x}'.format(imsi[4]))[1], ('{0:0>2x}'.format(imsi[4]))[0],
-                    ('{0:0>2x}'.format(imsi[5]))[1], ('{0:0>2x}'.format(imsi[5]))[0],
-                    ('{0:0>2x}'.format(imsi[6]))[1], ('{0:0>2x}'.format(imsi[6]))[0],
-                    ('{0:0>2x}'.format(imsi[7]))[1], ('{0:0>2x}'.format(imsi[7]))[0]
-                )
-                (recordHeader_SourceId, recordHeader_RecordType, recordHeader_RecordTlvDataLength, recordHeader_MessageCount,
-                    recordHeader_RecordContentLength, recordHeader_RecordSequence) = struct.unpack('=LBBHHH', f.read(12))
-
-                #Add only data records which present in list filterByImsi or all records if list filterByImsi is empty
-                if len(filterByImsi) == 0 or recordHeader_ueIdInfo_ImsiInformation_ImsiElement in filterByImsi:
-
-                    if recordHeader_RecordTlvDataLength > 0:
-                        recordTlvData = f.read(recordHeader_RecordTlvDataLength).hex()
-                        #print('!!!!!!! WARNING !!!!!!!\nFile: {0}\nRecord {1} has TLV Data: {2}\n!!!!!!! WARNING !!!!!!!'.format(
-                        #    file, rec, recordTlvData))
-
-                    if recordHeader_MessageCount > 0:
-                        if decodeRecordsContent:
-                            for m in range(recordHeader_MessageCount):
-                                (messageHeader_ProtocolType, messageHeader_ProcedureType, messageHeader_MessageType,
-                                    messageHeader_Direction, messageHeader_Second, messageHeader_ServiceCellId,
-                                    messageHeader_QuatMillisecond, messageHeader_MessageTlvDataLength,
-                                    messageHeader_MessageSequence, messageHeader_RawDataLength) = struct.unpack('=BBBBLHBBHH', f.read(16))
-
-
-                                messageTlvData = ''
-                                if messageHeader_MessageTlvDataLength > 0:
-                                    messageTlvData = f.read(messageHeader_MessageTlvDataLength).hex()
-                                    #print('!!!!!!! WARNING !!!!!!!\nFile: {0}\nRecord {1} Message {2} has TLV Data: {3}\n!!!!!!! WARNING !!!!!!!'.format(
-                                    #    file, rec, m, messageTlvData))
-
-                                messageRawData = ''
-                                if messageHeader_RawDataLength > 0:
-                                    if saveMessageRawData:
-                                        messageRawData = f.read(messageHeader_RawDataLength).hex()
-                                    else:
-                                        f.read(messageHeader_RawDataLength)
-
-                                message = {'header': {'protocolType': messageHeader_ProtocolType,
-                                                        'procedureType':messageHeader_ProcedureType,
-                                                        'messageType':messageHeader_MessageType,
-                                                        'direction':messageHeader_Direction,
-                                                        'second': messageHeader_Second,
-                                                        'serviceCellId':messageHeader_ServiceCellId,
-                                                        'quatMillisecond':messageHeader_QuatMillisecond,
-                                                        'messageTlvDataLength':messageHeader_MessageTlvDataLength,
-                                                        'messageSequence':messageHeader_MessageSequence,
-                                                        'rawDataLength':messageHeader_RawDataLength},
-                                            'tlvData': messageTlvData, 'rawData': messageRawData
-                                }
-                                #from pprint import pprint
-                                #pprint(message)
-                                messages.append(message)
-                        else:
-                            recordRawContent = f.read(recordHeader_RecordContentLength).hex()
-
-                    record = {'recordLength':recordLength, 'recordHeader':{
-                                'ueIdInfo': {
-                                    'GlobalCallId': recordHeader_ueIdInfo_GlobalCallId,
-                                    'ImsiLength': recordHeader_ueIdInfo_ImsiInformation_ImsiLength,
-                                    'AccessCellId': recordHeader_ueIdInfo_ImsiInformation_AccessCellId,
-                                    'ImsiElement': recordHeader_ueIdInfo_ImsiInformation_ImsiElement
-                                },
-                                'SourceId': recordHeader_SourceId,
-                                'RecordType': recordHeader_RecordType,
-                                'RecordTlvDataLength': recordHeader_RecordTlvDataLength,
-                                'MessageCount': recordHeader_MessageCount,
-                                'RecordContentLength': recordHeader_RecordContentLength,
-                                'RecordSequence': recordHeader_RecordSequence
-                            },
-                            'recordTlvData': recordTlvData, 'recordContent':messages, 'recordRawContent':recordRawContent}
-                    #from pprint import pprint
-                    #pprint(record)
-                    dataRecords.append(record)
-                else:
-                    #Read the rest of the data record
-                    f.read(recordHeader_RecordTlvDataLength + recordHeader_RecordContentLength)
-
-                #Record end flag (const 0xEFFE (61438)
-                byte = f.read(2)
-                if byte != b'\xfe\xef':
-                    print('!!!!!!! WARNING !!!!!!!\nFile: {0}\nRecord {1} has wrong Record end flag: {2}\n!!!!!!! WARNING !!!!!!!'.format(
-                        file, rec, byte.hex()))
-
-    result['dataRecords'] = dataRecords
-    return result
+    fstParser = FstParser()
+    fileInfo = fstParser.open(file)
+    fstParser.close()
+    batches = _read_record_batches(file, batchSize if batchSize > 0 else fileInfo['FileRecordNumber'],
+                                   decodeRecordsContent, saveMessageRawData, filterByImsi,
+                                   PayloadTable() if internPayloads and batchSize == 0 else None)
+    if batchSize > 0:
+        return {'file': fileInfo, 'dataRecords': batches}
+
+    dataRecords = list()
+    for batch in batches:
+        dataRecords.extend(batch)
+    return {'file': fileInfo, 'dataRecords': dataRecords}
+
+
+def _read_record_batches(file: str, batchSize: int, decodeRecordsContent: bool, saveMessageRawData: bool, filterByImsi: list,
+                         payloadTable = None):
+    #Generator of lists of up to batchSize data records, the file is open only while it is iterated
+    fstParser = FstParser()
+    fstParser.open(file)
+    fstParser.setPayloadTable(payloadTable)
+    try:
+        batch = list()
+        for record in fstParser.readRecords(decodeRecordsContent, saveMessageRawData, filterByImsi):
+            batch.append(record)
+            if len(batch) >= batchSize:
+                yield batch
+                batch = list()
+        if len(batch) > 0:
+            yield batch
+    finally:
+        fstParser.close()
 
 
 def toDateTime(seconds: int, milliseconds=0) ->datetime:
@@ -208,6 +137,144 @@ def toDateTime(seconds: int, milliseconds=0) ->datetime:
     return dt
 
 
+def estimateCount(count: int, fraction: float, sumSquares = None) -> tuple:
+    """
+    Scale up a count obtained from sampled records
+
+    Parameters
+    ----------
+    count: int
+        Count over the sampled records
+
+    fraction: float
+        Sampled fraction of records, see FstParser.samplingStats()
+
+    sumSquares = None
+        For 'imsi' sampling: sum of squares of the per-IMSI counts over the
+        sampled records. Whole subscribers are sampled, so the error depends on
+        how the count is spread over them. None - independent sampling of records
+
+    Returns
+    -------
+    tuple
+        (estimate, standard error)
+    """
+
+    if fraction <= 0:
+        return 0, 0
+    if sumSquares == None:
+        sumSquares = count   # every record is its own sampling unit
+    return count / fraction, math.sqrt(sumSquares * (1 - fraction)) / fraction
+
+
+def toZteSeconds(dt: datetime) -> int:
+    """
+    Convert Datetime to ZTE timestamp (seconds since 01.01.2000)
+
+    Parameters
+    ----------
+    dt: datetime
+        Datetime in the same time zone as the FST file
+
+    Returns
+    -------
+    int
+        ZTE time in seconds
+    """
+
+    return int((dt - datetime(year=2000, month=1, day=1)).total_seconds())
+
+
+
+ZTE_EPOCH = 946684800  #01.01.2000 00:00:00 in Unix time
+
+
+class TimeConverter:
+    """
+    Fast conversion of ZTE message time (seconds since 01.01.2000 and quarter
+    milliseconds) without creating datetime objects for every message
+
+    ZTE times are local times of the network. Conversion to Unix (pcap) time
+    depends on the time zone, text representation is cached per second.
+    """
+
+    def __init__(self, timezone = 10800):
+        """
+        Parameters
+        ----------
+        timezone = 10800
+            Time zone of the FST times: offset from UTC in seconds (10800 = GMT+3),
+            tzinfo object or IANA time zone name (e.g. 'Europe/Moscow'), the
+            last two take daylight saving time into account
+        """
+
+        if isinstance(timezone, str):
+            from zoneinfo import ZoneInfo
+            timezone = ZoneInfo(timezone)
+        if isinstance(timezone, int):
+            self.__offset = timezone
+            self.__tz = None
+        else:
+            self.__offset = None
+            self.__tz = timezone
+        self.__unixCache = dict()
+        self.__textCache = dict()
+
+
+    def toUnix(self, seconds: int) -> int:
+        """
+        Convert ZTE seconds to Unix time (UTC)
+        """
+
+        if self.__tz == None:
+            return seconds + ZTE_EPOCH - self.__offset
+        unix = self.__unixCache.get(seconds)
+        if unix == None:
+            if len(self.__unixCache) > 100000:
+                self.__unixCache.clear()
+            local = datetime(year=2000, month=1, day=1) + timedelta(seconds=seconds)
+            unix = int(local.replace(tzinfo=self.__tz).timestamp())
+            self.__unixCache[seconds] = unix
+        return unix
+
+
+    def toPcapTime(self, seconds: int, quatMillisecond = 0) -> tuple:
+        """
+        Convert ZTE message time to pcap time
+
+        Returns
+        -------
+        tuple
+            (sec, usec) in Unix time (UTC)
+        """
+
+        milliseconds = quatMillisecond * 4
+        if milliseconds >= 1000:
+            seconds += milliseconds // 1000
+            milliseconds %= 1000
+        return self.toUnix(seconds), milliseconds * 1000
+
+
+    def toText(self, seconds: int, quatMillisecond = 0) -> str:
+        """
+        Convert ZTE message time to text, the result is the same as
+        str(toDateTime(seconds, milliseconds=quatMillisecond*4))
+        """
+
+        milliseconds = quatMillisecond * 4
+        if milliseconds >= 1000:
+            seconds += milliseconds // 1000
+            milliseconds %= 1000
+        text = self.__textCache.get(seconds)
+        if text == None:
+            if len(self.__textCache) > 100000:
+                self.__textCache.clear()
+            text = str(toDateTime(seconds))
+            self.__textCache[seconds] = text
+        if milliseconds == 0:
+            return text
+        return '{0}.{1:03}000'.format(text, milliseconds)
+
 
 class FstParser:
 
@@ -215,6 +282,23 @@ class FstParser:
         self.__fstfile = None
         self.__fstfileName = None
         self.__fstfileInfo = None
+        # protocolType..direction skipped (4 bytes), second, serviceCellId..quatMillisecond skipped (3 bytes),
+        # messageTlvDataLength, messageSequence skipped (2 bytes), rawDataLength
+        self.__message_index_struct = struct.Struct('=4xL3xB2xH')
+        # Used only in recovery mode of readRecords()
+        self.__record_check_struct = struct.Struct('=H25xBHH')   # recordLength, RecordTlvDataLength, MessageCount, RecordContentLength
+        self.__message_check_struct = struct.Struct('=11xB2xH')  # messageTlvDataLength, rawDataLength
+        self.__fstmmap = None
+        self.__recordLengthDelta = None
+        self.__skippedRanges = list()
+        # Sampling, see setSampling()
+        self.__samplingMode = None
+        self.__samplingRate = 1
+        self.__samplingRandom = None
+        self.__recordsSeen = 0
+        self.__recordsSampled = 0
+        # Payload interning, see setPayloadTable()
+        self.__payloadTable = None
 
 
     def open(self, file: str) -> dict:
@@ -234,102 +318,375 @@ class FstParser:
         return self.__fstfileInfo
 
 
-    def readRecords(self, decodeRecordsContent = True, saveMessageRawData = True, filterByImsi = list()) -> dict:
+    def setSampling(self, mode = None, rate = 1, seed = 0):
+        """
+        Decode only a sample of the data records, the rest is skipped by seek
+        without decoding
+
+        Parameters
+        ----------
+        mode = None
+            None - all records
+            'nth' - every rate-th record
+            'random' - random records with probability rate
+            'imsi' - all records of the IMSIs which hash falls below rate, so
+                     complete subscribers are kept (the same IMSIs in all files)
+
+        rate = 1
+            N for 'nth' mode, fraction 0..1 for 'random' and 'imsi' modes
+
+        seed = 0
+            Seed of the random generator for 'random' mode
+        """
+
+        if mode not in (None, 'nth', 'random', 'imsi'):
+            raise ValueError('Unknown sampling mode: ' + str(mode))
+        if mode == 'nth' and (not isinstance(rate, int) or rate < 1):
+            raise ValueError('Sampling rate of nth mode has to be integer >= 1: ' + str(rate))
+        if mode in ('random', 'imsi') and not 0 < rate <= 1:
+            raise ValueError('Sampling rate of {0} mode has to be fraction in (0, 1]: {1}'.format(mode, rate))
+        self.__samplingMode = mode
+        self.__samplingRate = rate
+        self.__samplingRandom = random.Random(seed)
+        self.__recordsSeen = 0
+        self.__recordsSampled = 0
+
+
+    def setPayloadTable(self, payloadTable):
+        """
+        Intern message TLV data and raw data: identical payloads are converted to
+        hex only once and share the same str in all records
+
+        Parameters
+        ----------
+        payloadTable: parsers.payloads.PayloadTable
+            Table shared by all files (None - no interning)
+        """
+
+        self.__payloadTable = payloadTable
+
+
+    def samplingStats(self) -> dict:
+        """
+        Returns
+        -------
+        dict
+            {'records': records passed by readRecords(), 'sampled': records selected
+             by sampling, 'fraction': sampled/records}
+        """
+
+        fraction = self.__recordsSampled / self.__recordsSeen if self.__recordsSeen > 0 else 1
+        return {'records': self.__recordsSeen, 'sampled': self.__recordsSampled, 'fraction': fraction}
+
+
+    def readRecords(self, decodeRecordsContent = True, saveMessageRawData = True, filterByImsi = list(), recover = False) -> dict:
+        """
+        Read data records of the file one by one
+
+        Parameters
+        ----------
+        decodeRecordsContent = True, saveMessageRawData = True, filterByImsi = list()
+            See parser_umts_gsm()
+
+        recover = False
+            Recovery mode for corrupted or truncated files. Every record is checked
+            for plausibility before decoding (consistent lengths, sane message headers,
+            record end flag 0xFEEF at the expected position). If the check fails, the
+            file is scanned for the next 0xFEEF end flag followed by a plausible record
+            and decoding resumes from there. Skipped byte ranges are available from
+            skippedRanges()
+
+        Only records selected by setSampling() are decoded.
+
+        Returns
+        -------
+        dict
+            Yields data records, see parser_umts_gsm()
+        """
+
+        if recover:
+            yield from self.__readRecordsRecovering(decodeRecordsContent, saveMessageRawData, filterByImsi)
+            return
+
         for rec in range(self.__fstfileInfo['FileRecordNumber']):
-            recordTlvData =''
-            recordRawContent =''
-            messages =list()
-            recordLength, recordHeader_ueIdInfo_GlobalCallId, recordHeader_ueIdInfo_ImsiInformation_ImsiLength = struct.unpack('=HQB', self.__fstfile.read(11))
-            self.__fstfile.read(1)  #Reserved 1 byte
-            recordHeader_ueIdInfo_ImsiInformation_AccessCellId, imsi = struct.unpack('=H8s', self.__fstfile.read(10))
-            recordHeader_ueIdInfo_ImsiInformation_ImsiElement = '{0}{1}{2}{3}{4}{5}{6}{7}{8}{9}{10}{11}{12}{13}{14}'.format(
-                ('{0:0>2x}'.format(imsi[0]))[0],
-                ('{0:0>2x}'.format(imsi[1]))[1], ('{0:0>2x}'.format(imsi[1]))[0],
-                ('{0:0>2x}'.format(imsi[2]))[1], ('{0:0>2x}'.format(imsi[2]))[0],
-                ('{0:0>2x}'.format(imsi[3]))[1], ('{0:0>2x}'.format(imsi[3]))[0],
-                ('{0:0>2x}'.format(imsi[4]))[1], ('{0:0>2x}'.format(imsi[4]))[0],
-                ('{0:0>2x}'.format(imsi[5]))[1], ('{0:0>2x}'.format(imsi[5]))[0],
-                ('{0:0>2x}'.format(imsi[6]))[1], ('{0:0>2x}'.format(imsi[6]))[0],
-                ('{0:0>2x}'.format(imsi[7]))[1], ('{0:0>2x}'.format(imsi[7]))[0]
-            )
-            (recordHeader_SourceId, recordHeader_RecordType, recordHeader_RecordTlvDataLength, recordHeader_MessageCount,
-                recordHeader_RecordContentLength, recordHeader_RecordSequence) = struct.unpack('=LBBHHH', self.__fstfile.read(12))
+            if self.__samplingMode != None and self.__skipUnsampled():
+                continue
+            record = self.__readRecordHeader()
 
             #Add only data records which present in list filterByImsi or all records if list filterByImsi is empty
-            if len(filterByImsi) == 0 or recordHeader_ueIdInfo_ImsiInformation_ImsiElement in filterByImsi:
-                if recordHeader_RecordTlvDataLength > 0:
-                    recordTlvData = self.__fstfile.read(recordHeader_RecordTlvDataLength).hex()
-
-                if recordHeader_MessageCount > 0:
-                    if decodeRecordsContent:
-                        for m in range(recordHeader_MessageCount):
-                            (messageHeader_ProtocolType, messageHeader_ProcedureType, messageHeader_MessageType,
-                                messageHeader_Direction, messageHeader_Second, messageHeader_ServiceCellId,
-                                messageHeader_QuatMillisecond, messageHeader_MessageTlvDataLength,
-                                messageHeader_MessageSequence, messageHeader_RawDataLength) = struct.unpack('=BBBBLHBBHH', self.__fstfile.read(16))
-
-                            messageTlvData = ''
-                            if messageHeader_MessageTlvDataLength > 0:
-                                messageTlvData = self.__fstfile.read(messageHeader_MessageTlvDataLength).hex()
-
-                            messageRawData = ''
-                            if messageHeader_RawDataLength > 0:
-                                if saveMessageRawData:
-                                    messageRawData = self.__fstfile.read(messageHeader_RawDataLength).hex()
-                                else:
-                                    self.__fstfile.read(messageHeader_RawDataLength)
-
-                            message = {'header': {'protocolType': messageHeader_ProtocolType,
-                                                    'procedureType':messageHeader_ProcedureType,
-                                                    'messageType':messageHeader_MessageType,
-                                                    'direction':messageHeader_Direction,
-                                                    'second': messageHeader_Second,
-                                                    'serviceCellId':messageHeader_ServiceCellId,
-                                                    'quatMillisecond':messageHeader_QuatMillisecond,
-                                                    'messageTlvDataLength':messageHeader_MessageTlvDataLength,
-                                                    'messageSequence':messageHeader_MessageSequence,
-                                                    'rawDataLength':messageHeader_RawDataLength},
-                                        'tlvData': messageTlvData, 'rawData': messageRawData
-                            }
-                            #from pprint import pprint
-                            #pprint(message)
-                            messages.append(message)
-                    else:
-                        recordRawContent = self.__fstfile.read(recordHeader_RecordContentLength).hex()
-
-                record = {'recordLength':recordLength, 'recordHeader':{
-                            'ueIdInfo': {
-                                'GlobalCallId': recordHeader_ueIdInfo_GlobalCallId,
-                                'ImsiLength': recordHeader_ueIdInfo_ImsiInformation_ImsiLength,
-                                'AccessCellId': recordHeader_ueIdInfo_ImsiInformation_AccessCellId,
-                                'ImsiElement': recordHeader_ueIdInfo_ImsiInformation_ImsiElement
-                            },
-                            'SourceId': recordHeader_SourceId,
-                            'RecordType': recordHeader_RecordType,
-                            'RecordTlvDataLength': recordHeader_RecordTlvDataLength,
-                            'MessageCount': recordHeader_MessageCount,
-                            'RecordContentLength': recordHeader_RecordContentLength,
-                            'RecordSequence': recordHeader_RecordSequence
-                        },
-                        'recordTlvData': recordTlvData, 'recordContent':messages, 'recordRawContent':recordRawContent}
-                #from pprint import pprint
-                #pprint(record)
+            if len(filterByImsi) == 0 or record['recordHeader']['ueIdInfo']['ImsiElement'] in filterByImsi:
+                self.__readRecordContent(record, decodeRecordsContent, saveMessageRawData)
             else:
-                #Read the rest of the data record
-                self.__fstfile.read(recordHeader_RecordTlvDataLength + recordHeader_RecordContentLength)
+                #Skip the rest of the data record
+                self.__fstfile.seek(record['recordHeader']['RecordTlvDataLength'] + record['recordHeader']['RecordContentLength'], 1)
                 record = None
 
-            #Record end flag (const 0xEFFE (61438)
-            byte = self.__fstfile.read(2)
-            if byte != b'\xfe\xef':
-                print('!!!!!!! WARNING !!!!!!!\nFile: {0}\nRecord {1} has wrong Record end flag: {2}\n!!!!!!! WARNING !!!!!!!'.format(
-                    file, rec, byte.hex()))
+            self.__checkRecordEndFlag(rec)
+            if record != None:
+                yield record
+
+
+    def readRecordAt(self, offset: int, decodeRecordsContent = True, saveMessageRawData = True) -> dict:
+        """
+        Read one data record which starts at the given offset of the file
+
+        Parameters
+        ----------
+        offset: int
+            Offset of the data record, e.g. taken from indexRecords()
+
+        Returns
+        -------
+        dict
+            Data record in the same format as readRecords() yields
+        """
+
+        self.__fstfile.seek(offset)
+        record = self.__readRecordHeader()
+        self.__readRecordContent(record, decodeRecordsContent, saveMessageRawData)
+        self.__checkRecordEndFlag(offset)
+        return record
+
+
+    def indexRecords(self) -> dict:
+        """
+        Fast scan of the file which reads only record and message headers and skips
+        all TLV and raw data
+
+        Returns
+        -------
+        dict
+            Yields for each data record:
+                {'offset', 'ImsiElement', 'GlobalCallId', 'firstSecond', 'lastSecond'}
+            where 'firstSecond'/'lastSecond' are ZTE message times (seconds since
+            01.01.2000) or None if the record has no messages
+        """
+
+        for rec in range(self.__fstfileInfo['FileRecordNumber']):
+            offset = self.__fstfile.tell()
+            record = self.__readRecordHeader()
+            header = record['recordHeader']
+            firstSecond = None
+            lastSecond = None
+            self.__fstfile.seek(header['RecordTlvDataLength'], 1)
+            if header['MessageCount'] > 0:
+                for m in range(header['MessageCount']):
+                    second, messageTlvDataLength, rawDataLength = self.__message_index_struct.unpack(self.__fstfile.read(16))
+                    self.__fstfile.seek(messageTlvDataLength + rawDataLength, 1)
+                    if firstSecond == None or second < firstSecond:
+                        firstSecond = second
+                    if lastSecond == None or second > lastSecond:
+                        lastSecond = second
+            else:
+                self.__fstfile.seek(header['RecordContentLength'], 1)
+            self.__checkRecordEndFlag(rec)
+            yield {'offset': offset, 'ImsiElement': header['ueIdInfo']['ImsiElement'],
+                   'GlobalCallId': header['ueIdInfo']['GlobalCallId'],
+                   'firstSecond': firstSecond, 'lastSecond': lastSecond}
+
+
+    def __readRecordHeader(self) -> dict:
+        recordLength, recordHeader_ueIdInfo_GlobalCallId, recordHeader_ueIdInfo_ImsiInformation_ImsiLength = struct.unpack('=HQB', self.__fstfile.read(11))
+        self.__fstfile.read(1)  #Reserved 1 byte
+        recordHeader_ueIdInfo_ImsiInformation_AccessCellId, imsi = struct.unpack('=H8s', self.__fstfile.read(10))
+        recordHeader_ueIdInfo_ImsiInformation_ImsiElement = '{0}{1}{2}{3}{4}{5}{6}{7}{8}{9}{10}{11}{12}{13}{14}'.format(
+            ('{0:0>2x}'.format(imsi[0]))[0],
+            ('{0:0>2x}'.format(imsi[1]))[1], ('{0:0>2x}'.format(imsi[1]))[0],
+            ('{0:0>2x}'.format(imsi[2]))[1], ('{0:0>2x}'.format(imsi[2]))[0],
+            ('{0:0>2x}'.format(imsi[3]))[1], ('{0:0>2x}'.format(imsi[3]))[0],
+            ('{0:0>2x}'.format(imsi[4]))[1], ('{0:0>2x}'.format(imsi[4]))[0],
+            ('{0:0>2x}'.format(imsi[5]))[1], ('{0:0>2x}'.format(imsi[5]))[0],
+            ('{0:0>2x}'.format(imsi[6]))[1], ('{0:0>2x}'.format(imsi[6]))[0],
+            ('{0:0>2x}'.format(imsi[7]))[1], ('{0:0>2x}'.format(imsi[7]))[0]
+        )
+        (recordHeader_SourceId, recordHeader_RecordType, recordHeader_RecordTlvDataLength, recordHeader_MessageCount,
+            recordHeader_RecordContentLength, recordHeader_RecordSequence) = struct.unpack('=LBBHHH', self.__fstfile.read(12))
+
+        return {'recordLength':recordLength, 'recordHeader':{
+                    'ueIdInfo': {
+                        'GlobalCallId': recordHeader_ueIdInfo_GlobalCallId,
+                        'ImsiLength': recordHeader_ueIdInfo_ImsiInformation_ImsiLength,
+                        'AccessCellId': recordHeader_ueIdInfo_ImsiInformation_AccessCellId,
+                        'ImsiElement': recordHeader_ueIdInfo_ImsiInformation_ImsiElement
+                    },
+                    'SourceId': recordHeader_SourceId,
+                    'RecordType': recordHeader_RecordType,
+                    'RecordTlvDataLength': recordHeader_RecordTlvDataLength,
+                    'MessageCount': recordHeader_MessageCount,
+                    'RecordContentLength': recordHeader_RecordContentLength,
+                    'RecordSequence': recordHeader_RecordSequence
+                },
+                'recordTlvData': '', 'recordContent': list(), 'recordRawContent': ''}
+
+
+    def __readRecordContent(self, record: dict, decodeRecordsContent: bool, saveMessageRawData: bool):
+        recordHeader_RecordTlvDataLength = record['recordHeader']['RecordTlvDataLength']
+        recordHeader_MessageCount = record['recordHeader']['MessageCount']
+        recordHeader_RecordContentLength = record['recordHeader']['RecordContentLength']
+        messages = record['recordContent']
+
+        if recordHeader_RecordTlvDataLength > 0:
+            record['recordTlvData'] = self.__fstfile.read(recordHeader_RecordTlvDataLength).hex()
+
+        if recordHeader_MessageCount > 0:
+            if decodeRecordsContent:
+                for m in range(recordHeader_MessageCount):
+                    (messageHeader_ProtocolType, messageHeader_ProcedureType, messageHeader_MessageType,
+                        messageHeader_Direction, messageHeader_Second, messageHeader_ServiceCellId,
+                        messageHeader_QuatMillisecond, messageHeader_MessageTlvDataLength,
+                        messageHeader_MessageSequence, messageHeader_RawDataLength) = struct.unpack('=BBBBLHBBHH', self.__fstfile.read(16))
+
+                    messageTlvData = ''
+                    if messageHeader_MessageTlvDataLength > 0:
+                        if self.__payloadTable != None:
+                            messageTlvData = self.__payloadTable.intern(self.__fstfile.read(messageHeader_MessageTlvDataLength))
+                        else:
+                            messageTlvData = self.__fstfile.read(messageHeader_MessageTlvDataLength).hex()
+
+                    messageRawData = ''
+                    if messageHeader_RawDataLength > 0:
+                        if saveMessageRawData:
+                            if self.__payloadTable != None:
+                                messageRawData = self.__payloadTable.intern(self.__fstfile.read(messageHeader_RawDataLength))
+                            else:
+                                messageRawData = self.__fstfile.read(messageHeader_RawDataLength).hex()
+                        else:
+                            self.__fstfile.seek(messageHeader_RawDataLength, 1)
+
+                    message = {'header': {'protocolType': messageHeader_ProtocolType,
+                                            'procedureType':messageHeader_ProcedureType,
+                                            'messageType':messageHeader_MessageType,
+                                            'direction':messageHeader_Direction,
+                                            'second': messageHeader_Second,
+                                            'serviceCellId':messageHeader_ServiceCellId,
+                                            'quatMillisecond':messageHeader_QuatMillisecond,
+                                            'messageTlvDataLength':messageHeader_MessageTlvDataLength,
+                                            'messageSequence':messageHeader_MessageSequence,
+                                            'rawDataLength':messageHeader_RawDataLength},
+                                'tlvData': messageTlvData, 'rawData': messageRawData
+                    }
+                    messages.append(message)
+            else:
+                record['recordRawContent'] = self.__fstfile.read(recordHeader_RecordContentLength).hex()
+
+
+    def skippedRanges(self) -> list:
+        """
+        Returns
+        -------
+        list
+            Byte ranges [(start, end), ...] of the file skipped by readRecords(recover=True)
+        """
+
+        return self.__skippedRanges
+
+
+    def __readRecordsRecovering(self, decodeRecordsContent: bool, saveMessageRawData: bool, filterByImsi: list):
+        if self.__fstmmap == None:
+            self.__fstmmap = mmap.mmap(self.__fstfile.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self.__fstmmap)
+        pos = self.__fstfile.tell()
+        rec = 0
+        while rec < self.__fstfileInfo['FileRecordNumber'] and pos < size:
+            if not self.__isPlausibleRecord(pos):
+                start = pos
+                pos = self.__resync(pos + 1)
+                self.__skippedRanges.append((start, pos))
+                print('!!!!!!! WARNING !!!!!!!\nFile: {0}\nRecord {1} is corrupted, skipped bytes {2}-{3}\n!!!!!!! WARNING !!!!!!!'.format(
+                    self.__fstfileName, rec, start, pos))
+                if pos >= size:
+                    break
+                self.__fstfile.seek(pos)
+
+            if self.__samplingMode != None and self.__skipUnsampled():
+                pos = self.__fstfile.tell()
+                rec += 1
+                continue
+            record = self.__readRecordHeader()
+            if len(filterByImsi) == 0 or record['recordHeader']['ueIdInfo']['ImsiElement'] in filterByImsi:
+                self.__readRecordContent(record, decodeRecordsContent, saveMessageRawData)
+            else:
+                self.__fstfile.seek(record['recordHeader']['RecordTlvDataLength'] + record['recordHeader']['RecordContentLength'], 1)
+                record = None
+            self.__checkRecordEndFlag(rec)
+            pos = self.__fstfile.tell()
+            rec += 1
             if record != None:
                 yield record
 
 
+    def __skipUnsampled(self) -> bool:
+        #Decide on the raw record header if the record is sampled, skip the whole record by seek if not
+        header = self.__fstfile.read(34)
+        self.__recordsSeen += 1
+        if self.__samplingMode == 'nth':
+            sampled = (self.__recordsSeen - 1) % self.__samplingRate == 0
+        elif self.__samplingMode == 'random':
+            sampled = self.__samplingRandom.random() < self.__samplingRate
+        else:
+            sampled = zlib.crc32(header[14:22]) < self.__samplingRate * 0x100000000   #IMSI bytes
+        if sampled:
+            self.__recordsSampled += 1
+            self.__fstfile.seek(-len(header), 1)
+            return False
+        recordLength, tlvLength, messageCount, contentLength = self.__record_check_struct.unpack(header[:32])
+        self.__fstfile.seek(tlvLength + contentLength + 2, 1)   #with record end flag
+        return True
+
+
+    def __resync(self, pos: int) -> int:
+        #Find the next record end flag followed by a plausible record, returns file size if nothing found
+        while True:
+            flag = self.__fstmmap.find(b'\xfe\xef', pos)
+            if flag < 0:
+                return len(self.__fstmmap)
+            if self.__isPlausibleRecord(flag + 2):
+                return flag + 2
+            pos = flag + 1
+
+
+    def __isPlausibleRecord(self, pos: int) -> bool:
+        m = self.__fstmmap
+        if pos + 36 > len(m):
+            return False
+        recordLength, tlvLength, messageCount, contentLength = self.__record_check_struct.unpack_from(m, pos)
+        end = pos + 34 + tlvLength + contentLength
+        if end + 2 > len(m) or m[end:end + 2] != b'\xfe\xef':
+            return False
+        if messageCount * 16 > contentLength:
+            return False
+        # recordLength minus data lengths is the same for all records of the file
+        if self.__recordLengthDelta != None and recordLength - tlvLength - contentLength != self.__recordLengthDelta:
+            return False
+        if messageCount > 0:
+            offset = pos + 34 + tlvLength
+            for i in range(messageCount):
+                if offset + 16 > end:
+                    return False
+                # quatMillisecond is not checked, values >= 250 roll over into the next second (see TimeConverter)
+                messageTlvLength, rawLength = self.__message_check_struct.unpack_from(m, offset)
+                offset += 16 + messageTlvLength + rawLength
+            if offset != end:
+                return False
+        if self.__recordLengthDelta == None:
+            self.__recordLengthDelta = recordLength - tlvLength - contentLength
+        return True
+
+
+    def __checkRecordEndFlag(self, rec: int) -> bool:
+        #Record end flag (const 0xEFFE (61438)
+        byte = self.__fstfile.read(2)
+        if byte != b'\xfe\xef':
+            print('!!!!!!! WARNING !!!!!!!\nFile: {0}\nRecord {1} has wrong Record end flag: {2}\n!!!!!!! WARNING !!!!!!!'.format(
+                self.__fstfileName, rec, byte.hex()))
+            return False
+        return True
+
 
     def close(self):
+        if self.__fstmmap != None:
+            self.__fstmmap.close()
+            self.__fstmmap = None
         self.__fstfile.close()
 
 
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+This module contains the class for tracking which FST files were already fully
+processed, so that re-runs over a trace directory handle only new or changed files
+"""
+import os
+import json
+
+
+class Manifest:
+    """
+    Manifest of processed FST files
+
+    Each entry is keyed by the full path of the source file and keeps the file
+    signature (size, mtime and header FileNo/timestamps), the processing settings,
+    the produced output files (decoded text) with their sizes, the number and
+    total size of the per-record pcap-files and the processing status. Pcap-files
+    are not listed one by one, as there may be millions of them, so only the
+    listed outputs are checked by is_processed().
+    An entry is saved with status 'done' only when all outputs are closed. A file
+    which had a 'done' entry is marked 'started' before its outputs are
+    overwritten, so a crashed run leaves no 'done' entry for partial outputs and
+    the file is redone on the next run. The manifest is saved once per new file.
+    """
+
+    def __init__(self):
+        self.__manifestFile = None
+        self.__entries = dict()
+
+
+    def open(self, file: str) -> dict:
+        """
+        Load manifest from the json file. Missing or broken file gives empty manifest
+
+        Parameters
+        ----------
+        file: str
+            Full path to the manifest json-file
+
+        Returns
+        -------
+        dict
+            Loaded entries
+        """
+
+        self.__manifestFile = file
+        self.__entries = dict()
+        if os.path.exists(file):
+            try:
+                with open(file) as f:
+                    self.__entries = json.load(f)
+            except (ValueError, OSError):
+                print('!!!!!!! WARNING !!!!!!!\nManifest {0} is broken and will be rebuilt\n!!!!!!! WARNING !!!!!!!'.format(file))
+                self.__entries = dict()
+        return self.__entries
+
+
+    def signature(self, source_file: str, fileInfo: dict) -> dict:
+        """
+        Build signature of the source file from its stat and FST file header
+
+        Parameters
+        ----------
+        source_file: str
+            Full path to the FST data file
+
+        fileInfo: dict
+            File header returned by FstParser.open()
+
+        Returns
+        -------
+        dict
+            {'size', 'mtime', 'FileNo', 'FileStartTimestamp', 'FileEndTimestamp'}
+        """
+
+        st = os.stat(source_file)
+        return {'size': st.st_size, 'mtime': st.st_mtime_ns,
+                'FileNo': fileInfo['FileNo'],
+                'FileStartTimestamp': str(fileInfo['FileStartTimestamp']),
+                'FileEndTimestamp': str(fileInfo['FileEndTimestamp'])}
+
+
+    def is_processed(self, source_file: str, signature: dict, settings: dict) -> bool:
+        """
+        Check if the file was fully processed with the same settings and all its
+        outputs are still present and complete
+
+        Parameters
+        ----------
+        source_file: str
+            Full path to the FST data file
+
+        signature: dict
+            Current signature of the file, see signature()
+
+        settings: dict
+            Current processing settings
+
+        Returns
+        -------
+        bool
+            True if the file can be skipped
+        """
+
+        entry = self.__entries.get(self.__key(source_file))
+        if entry is None or entry['status'] != 'done':
+            return False
+        if entry['signature'] != signature or entry['settings'] != settings:
+            return False
+        for output, size in entry['outputs'].items():
+            if not os.path.exists(output) or os.path.getsize(output) != size:
+                return False
+        return True
+
+
+    def mark_started(self, source_file: str, signature: dict, settings: dict):
+        previous = self.__entries.get(self.__key(source_file))
+        self.__entries[self.__key(source_file)] = {'status': 'started', 'signature': signature,
+                                                   'settings': settings, 'outputs': dict(),
+                                                   'pcap': {'count': 0, 'size': 0}}
+        #Saving is needed only to invalidate the 'done' entry of the outputs being overwritten
+        if previous != None and previous['status'] == 'done':
+            self.save()
+
+
+    def mark_done(self, source_file: str, outputs: list, pcapCount = 0, pcapSize = 0):
+        """
+        Parameters
+        ----------
+        source_file: str
+            Full path to the FST data file
+
+        outputs: list
+            Output files checked by is_processed() (decoded text file)
+
+        pcapCount = 0, pcapSize = 0
+            Number and total size of pcap-files written for the file
+        """
+
+        entry = self.__entries[self.__key(source_file)]
+        entry['status'] = 'done'
+        entry['outputs'] = {output: os.path.getsize(output) for output in outputs}
+        entry['pcap'] = {'count': pcapCount, 'size': pcapSize}
+        self.save()
+
+
+    def save(self):
+        # Write to temporary file and replace, so manifest itself is never partially written
+        tmp_file = self.__manifestFile + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.__entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.__manifestFile)
+
+
+    def __key(self, source_file: str) -> str:
+        return os.path.abspath(source_file)
+
+
+if __name__ == '__main__':
+    print('Module manifest.py is not main application')
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+This module contains the class for interning of identical message payloads
+(system information, paging, common measurements) in the decode path and in
+the decoded text file
+"""
+import sys
+
+
+class PayloadTable:
+    """
+    Content-hash payload table
+
+    intern() is used by FstParser (see FstParser.setPayloadTable()): identical
+    payloads are converted to hex only once and all records share the same str
+    object. It saves memory only where many records are kept in memory (whole
+    file read by parser_umts_gsm(), records of sessions for pcap-files): when
+    records are processed one by one, the strs would be freed anyway and the
+    table itself is the only memory used. reference() is used by
+    write_record_text(): every distinct payload is written in full once per
+    decoded file, repeats are written as '@<record>.<message>', the numbers of
+    the data record and of the message in the record where the payload was
+    written in full. The two uses are independent, one instance is used for
+    one of them.
+
+    Both tables are limited to maxBytes bytes of memory (keys and values).
+    When the limit is reached the table is cleared, so memory is bounded (a
+    payload seen after clearing is written in full again).
+    """
+
+    def __init__(self, maxBytes = 16 << 20, minLength = 8):
+        """
+        Parameters
+        ----------
+        maxBytes = 16 << 20
+            Maximal memory of every table in bytes
+
+        minLength = 8
+            Payloads shorter than minLength bytes are always written in full
+        """
+
+        self.__maxBytes = maxBytes
+        self.__minLength = minLength
+        self.__payloads = dict()     # bytes -> hex str
+        self.__payloadsBytes = 0
+        self.__references = dict()   # hex str -> (record, message)
+        self.__referencesBytes = 0
+        self.__stats = {'payloads': 0, 'shared': 0, 'tableBytes': 0, 'references': 0, 'referencedBytes': 0}
+
+
+    def intern(self, data: bytes) -> str:
+        """
+        Returns
+        -------
+        str
+            Hex string of data, the same object for identical payloads
+        """
+
+        self.__stats['payloads'] += 1
+        text = self.__payloads.get(data)
+        if text != None:
+            self.__stats['shared'] += 1
+            return text
+        text = data.hex()
+        size = sys.getsizeof(data) + sys.getsizeof(text)
+        if self.__payloadsBytes + size > self.__maxBytes:
+            self.__payloads.clear()
+            self.__payloadsBytes = 0
+        self.__payloads[data] = text
+        self.__payloadsBytes += size
+        if self.__payloadsBytes > self.__stats['tableBytes']:
+            self.__stats['tableBytes'] = self.__payloadsBytes
+        return text
+
+
+    def reference(self, text: str, rec: int, msg: int) -> str:
+        """
+        Parameters
+        ----------
+        text: str
+            Payload in hex
+
+        rec: int, msg: int
+            Number of the data record in the decoded file and of the message in the record
+
+        Returns
+        -------
+        str
+            Text of the payload for the decoded file: hex for the first
+            occurrence in the file, '@<record>.<message>' for repeats
+        """
+
+        if len(text) < 2 * self.__minLength:
+            return text
+        location = self.__references.get(text)
+        if location != None:
+            reference = '@{0}.{1}'.format(*location)
+            self.__stats['references'] += 1
+            self.__stats['referencedBytes'] += len(text) - len(reference)
+            return reference
+        size = sys.getsizeof(text) + 64   # with the (record, message) tuple
+        if self.__referencesBytes + size > self.__maxBytes:
+            self.__references.clear()
+            self.__referencesBytes = 0
+        self.__references[text] = (rec, msg)
+        self.__referencesBytes += size
+        return text
+
+
+    def reset_references(self):
+        """
+        Start a new decoded file: every payload is written in full once again
+        """
+
+        self.__references.clear()
+        self.__referencesBytes = 0
+
+
+    def report(self) -> dict:
+        """
+        Returns
+        -------
+        dict
+            {'payloads': interned payloads, 'shared': payloads which reused
+             an existing str, 'tableBytes': the largest memory of the interning
+             table, 'references': payloads written as reference,
+             'referencedBytes': characters of the decoded files saved by references}
+        """
+
+        return dict(self.__stats)
+
+
+if __name__ == '__main__':
+    print('Module payloads.py is not main application')
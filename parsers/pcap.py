@@ -1,14 +1,303 @@
 #!/usr/bin/env python3
 
 import sys
+import struct
 import binascii
 import datetime
+from parsers.compress import open_output
+from parsers.file_parsers import TimeConverter
+
+
+#Wireshark dissector names used in exported_pdu encapsulation
+#by protocol (from protocols_pcap.json)
+EXPORTED_PDU_PROTOCOLS = {'RANAP': 'ranap', 'A': 'bssap', 'NBAP': 'nbap', 'RNSAP': 'rnsap'}
+#by pocedureName (from protocols_pcap.json), the same as in plugins/zte_fst.lua
+EXPORTED_PDU_PROCEDURES = {'DL DCCH': 'rrc.dl.dcch', 'DL CCCH': 'rrc.dl.ccch', 'UL DCCH': 'rrc.ul.dcch',
+                           'UL CCCH': 'rrc.ul.ccch', 'BCCH FACH': 'rrc.bcch.fach', 'PCCH': 'rrc.pcch',
+                           'Abis': 'gsm_abis_rsl', 'RLC-MAC-UP': 'gsm_rlcmac_ul', 'RLC-MAC-DOWN': 'gsm_rlcmac_dl',
+                           'LLC': 'llcgprs'}
+
+
+#UDP ports by pocedureName, the same as in plugins/zte_fst.lua (RNSAP always
+#uses 5005, unknown procedures 999)
+UDP_PORTS = {'DL DCCH': 5000, 'DL CCCH': 5001, 'UL DCCH': 5002, 'UL CCCH': 5003, 'BCCH FACH': 5004,
+             'PCCH': 5006, 'Abis': 5100, 'RLC-MAC-UP': 5102, 'RLC-MAC-DOWN': 5103, 'LLC': 5104}
+
+
+class PcapMappingError(LookupError):
+    """
+    Message has no pcap encapsulation (protocols_pcap.json has no entry for its
+    protocol type/direction/procedure type, or the protocol can not be written)
+    """
+
+    def __init__(self, report: str, protocolType = None, direction = None, procedureType = None, messageType = None):
+        super().__init__(report)
+        self.protocolType = protocolType
+        self.direction = direction
+        self.procedureType = procedureType
+        self.messageType = messageType
+
+
+class Encapsulation:
+    """
+    Prebuilt encapsulation of one protocol/direction/procedure of protocols_pcap.json
+
+    Headers with fixed addresses, ports and point codes are packed once, only
+    lengths, IP checksum and SCTP TSN/SSN are filled in for every message.
+    ethernet_frame() is bound to the builder of the protocol when the object is
+    created:
+        RANAP, A - Ethernet/IPv4/SCTP (PPID 3)/M3UA
+        NBAP - Ethernet/IPv4/SCTP (PPID 25)
+        UU, Abis, UM, RNSAP - Ethernet/IPv4/UDP, port from UDP_PORTS (needs plugins/zte_fst.lua)
+    """
+
+    #eth_header = ('00 00 00 00 00 00'     #Source Mac
+    #              '00 00 00 00 00 00'     #Dest Mac
+    #              '08 00')                #Protocol (0x0800 = IP)
+    ETH_HEADER = bytes.fromhex('0000000000000000000000000800')
+
+    #ip_header = ('45'                    #IP version and header length (multiples of 4 bytes)
+    #             '00'
+    #             'XX XX'                 #Length
+    #             '00 00'
+    #             '40 00 40'
+    #             'PP'                    #Protocol (0x84 = SCTP, 0x11 = UDP)
+    #             'YY YY'                 #Checksum
+    #             'SS SS SS SS'           #Source IP
+    #             'DD DD DD DD')          #Dest IP
+    IP_HEADER = struct.Struct('>BBHHHBBH4s4s')
+
+    #sctp_header =   ('0b 59 0b 59 0e b0 00 2c 30 38 68 af 00 03'
+    #   'ZZ ZZ TT TT TT TT 00 0b SS SS PP PP PP PP')      #ZZ ZZ - Chunk length
+    #                                                     #TT TT TT TT - Transmission sequence number
+    #                                                     #SS SS - = Stream sequence number
+    #                                                     #PP PP PP PP - Payload protocol identifier
+    SCTP_COMMON_HEADER = bytes.fromhex('0b590b590eb0002c303868af0003')
+    SCTP_CHUNK_HEADER = struct.Struct('>HLHHL')
+
+    #m3ua_header =   ('01 00'
+    #   '01 01 MM MM MM MM 02 00 00 08 00 00 00 08 02 10' #MM MM MM MM - = MTP3 Message length (must be multiple of 4)
+    #   'PL PL OP OP OP OP DP DP DP DP 03 02 00 0a 06 12' #OP OP OP OP - = MTP3 OPC
+    #   '96 07 00 01 16' )                               #DP DP DP DP - = MTP3 DPC
+    #                                                     #PL PL - SS7 Message length = 23 + Message Length
+    M3UA_HEADER = struct.Struct('>4sL10sH')
+
+    #udp_header =   ('P1 P1'                 #Src Port
+    #                'P2 P2'                 #Dest Port
+    #                'YY YY'                 #Length
+    #                '00 00')
+    UDP_HEADER = struct.Struct('>HHHH')
+
+    #pcap packet header: time sec, time usec, frame size, frame size (little endian)
+    PACKET_HEADER = struct.Struct('<LLLL')
+
+    def __init__(self, protocol: str, pcap_data: dict):
+        """
+        Parameters
+        ----------
+        protocol: str
+            'protocol' of protocols_pcap.json entry
+
+        pcap_data: dict
+            'pcap_data' of the direction/procedure: {'source_ip', 'dest_ip', 'opc', 'dpc', 'pocedureName'}
+        """
+
+        self.protocol = protocol
+        self.pcap_data = pcap_data
+        procedureName = pcap_data.get('pocedureName')
+
+        #Additional byte of MAC header for proper decoding of UM by Wireshark
+        self.prefix = b''
+        if protocol == 'UM':
+            if procedureName == 'RLC-MAC-DOWN':
+                self.prefix = b'\x51'
+            elif procedureName == 'RLC-MAC-UP':
+                self.prefix = b'\x50'
+
+        #exported_pdu tags:
+        #'00 0C'   - EXP_PDU_TAG_PROTO_NAME
+        #'LL LL'   - Length of the dissector name padded to multiple of 4 bytes
+        #'NN .. 00'- Dissector name
+        #'00 00 00 00' - EXP_PDU_TAG_END_OF_OPT
+        if protocol in EXPORTED_PDU_PROTOCOLS:
+            self.dissector = EXPORTED_PDU_PROTOCOLS[protocol]
+        else:
+            self.dissector = EXPORTED_PDU_PROCEDURES.get(procedureName)
+        self.__tags = None
+        if self.dissector != None:
+            name = self.dissector.encode()
+            name += b'\0' * (-len(name) % 4)
+            self.__tags = struct.pack('>HH', 12, len(name)) + name + struct.pack('>HH', 0, 0)
+
+        if protocol == 'RANAP' or protocol == 'A':
+            ip_protocol = 0x84
+            self.__ppid = 3
+            self.__m3ua_tail = struct.pack('>LL', pcap_data['opc'], pcap_data['dpc']) + bytes.fromhex('0302000a06129607000116')
+            self.ethernet_frame = self.__sctp_m3ua_frame
+        elif protocol == 'NBAP':
+            ip_protocol = 0x84
+            self.__ppid = 25
+            self.ethernet_frame = self.__sctp_frame
+        elif protocol == 'UU' or protocol == 'Abis' or protocol == 'UM' or protocol == 'RNSAP':
+            ip_protocol = 0x11
+            self.__port = 5005 if protocol == 'RNSAP' else UDP_PORTS.get(procedureName, 999)
+            self.ethernet_frame = self.__udp_frame
+        else:
+            ip_protocol = 0
+            self.ethernet_frame = self.__unsupported_frame
+
+        self.__source_ip = self.__ip_to_bytes(pcap_data.get('source_ip', '127.0.0.1'))
+        self.__dest_ip = self.__ip_to_bytes(pcap_data.get('dest_ip', '127.0.0.2'))
+        self.__ip_protocol = ip_protocol
+        #IP checksum of the header without length, the length is added for every message
+        header = self.IP_HEADER.pack(0x45, 0, 0, 0, 0x4000, 0x40, ip_protocol, 0, self.__source_ip, self.__dest_ip)
+        self.__ip_sum = sum(struct.unpack('>10H', header))
+
+
+    def exported_pdu_frame(self, msg: bytes, sec: int, usec: int) -> bytes:
+        if self.__tags == None:
+            raise PcapMappingError('Pcap exported_pdu: no Wireshark dissector for protocol {0}, procedure {1}'.format(
+                self.protocol, self.pcap_data.get('pocedureName')))
+        msg = self.prefix + msg
+        len_pcap = len(self.__tags) + len(msg)
+        return self.PACKET_HEADER.pack(sec, usec, len_pcap, len_pcap) + self.__tags + msg
+
+
+    def __sctp_m3ua_frame(self, msg: bytes, sec: int, usec: int, tsn: int, ssn: int) -> bytes:
+        msg = self.prefix + msg
+        len_ss7 = 23 + len(msg)
+        len_padding = -len_ss7 % 4
+        len_mtp3 = 16 + len_ss7 + len_padding
+        len_chunk = 16 + len_mtp3
+        l4 = (self.SCTP_COMMON_HEADER + self.SCTP_CHUNK_HEADER.pack(len_chunk, tsn, 11, ssn, self.__ppid) +
+              self.M3UA_HEADER.pack(b'\x01\x00\x01\x01', len_mtp3, b'\x02\x00\x00\x08\x00\x00\x00\x08\x02\x10', len_ss7) +
+              self.__m3ua_tail)
+        return self.__frame(12 + len_chunk, l4, msg + b'\0' * len_padding, sec, usec)
+
+
+    def __sctp_frame(self, msg: bytes, sec: int, usec: int, tsn: int, ssn: int) -> bytes:
+        msg = self.prefix + msg
+        len_padding = -len(msg) % 4
+        len_chunk = 16 + len(msg)   #Chunk length without padding
+        l4 = self.SCTP_COMMON_HEADER + self.SCTP_CHUNK_HEADER.pack(len_chunk, tsn, 11, ssn, self.__ppid)
+        return self.__frame(12 + len_chunk + len_padding, l4, msg + b'\0' * len_padding, sec, usec)
+
+
+    def __udp_frame(self, msg: bytes, sec: int, usec: int, tsn: int, ssn: int) -> bytes:
+        msg = self.prefix + msg
+        len_udp = 8 + len(msg)
+        return self.__frame(len_udp, self.UDP_HEADER.pack(self.__port, self.__port, len_udp, 0), msg, sec, usec)
+
+
+    def __unsupported_frame(self, msg: bytes, sec: int, usec: int, tsn: int, ssn: int) -> bytes:
+        raise PcapMappingError('Pcap ethernet: protocol {0} can not be encapsulated'.format(self.protocol))
+
+
+    def __frame(self, len_l4: int, l4: bytes, payload: bytes, sec: int, usec: int) -> bytes:
+        len_ip = 20 + len_l4
+        checksum = self.__ip_sum + len_ip
+        checksum += (checksum >> 16)
+        checksum = checksum & 0xFFFF ^ 0xFFFF
+        ip = self.IP_HEADER.pack(0x45, 0, len_ip, 0, 0x4000, 0x40, self.__ip_protocol, checksum, self.__source_ip, self.__dest_ip)
+        len_pcap = 14 + len_ip
+        return self.PACKET_HEADER.pack(sec, usec, len_pcap, len_pcap) + self.ETH_HEADER + ip + l4 + payload
+
+
+    def __ip_to_bytes(self, ip: str) -> bytes:
+        return bytes(int(octet) for octet in ip.split('.'))
+
+
+class EncapsulationTable:
+    """
+    Dispatch table (protocolType, direction, procedureType) -> Encapsulation,
+    compiled once from protocols_pcap.json. procedureType is part of the key
+    only for protocols with 'procedures' in the dictionary (UU, UM).
+    As search_for_pcap_data(), the first entry of a protocol type and the first
+    entry of a direction are used.
+    """
+
+    def __init__(self, dict_pcap: list):
+        """
+        Parameters
+        ----------
+        dict_pcap: list
+            Loaded pcap dictionary (protocols_pcap.json)
+        """
+
+        self.__table = dict()
+        self.__protocols = dict()   # protocolType -> protocol
+        for item in dict_pcap:
+            if item['protocolType'] in self.__protocols:
+                continue
+            self.__protocols[item['protocolType']] = item['protocol']
+            for d in item['dirs']:
+                if 'procedures' in d:
+                    for proc in d['procedures']:
+                        key = (item['protocolType'], d['dir'], proc['procedureType'])
+                        if key not in self.__table:
+                            self.__table[key] = Encapsulation(item['protocol'], proc['pcap_data'])
+                else:
+                    key = (item['protocolType'], d['dir'], None)
+                    if key not in self.__table:
+                        self.__table[key] = Encapsulation(item['protocol'], d['pcap_data'])
+
+
+    def lookup(self, protocolType: int, direction: int, procedureType: int, messageType = None) -> Encapsulation:
+        """
+        Returns
+        -------
+        Encapsulation
+            Encapsulation of the message, PcapMappingError is raised if there is none
+        """
+
+        encapsulation = self.__table.get((protocolType, direction, procedureType))
+        if encapsulation == None:
+            encapsulation = self.__table.get((protocolType, direction, None))
+            if encapsulation == None:
+                raise PcapMappingError(self.__report(protocolType, direction, procedureType, messageType),
+                                       protocolType, direction, procedureType, messageType)
+        return encapsulation
+
+
+    def __report(self, protocolType: int, direction: int, procedureType: int, messageType) -> str:
+        report = 'Pcap saving exception: Protocol type:{0}, Procedure type:{1}, Message type:{2}, Direction:{3} is not mapped in protocols_pcap.json: '.format(
+            protocolType, procedureType, messageType, direction)
+        if protocolType not in self.__protocols:
+            return report + 'unknown protocol type (mapped: {0})'.format(
+                ', '.join('{0} {1}'.format(k, v) for k, v in sorted(self.__protocols.items())))
+        directions = sorted(set(key[1] for key in self.__table if key[0] == protocolType))
+        if direction not in directions:
+            return report + 'unknown direction of {0} (mapped: {1})'.format(
+                self.__protocols[protocolType], ', '.join(str(d) for d in directions))
+        procedures = sorted(key[2] for key in self.__table if key[0] == protocolType and key[1] == direction)
+        return report + 'unknown procedure type of {0} direction {1} (mapped: {2})'.format(
+            self.__protocols[protocolType], direction, ', '.join(str(p) for p in procedures))
 
 
 class Pcap:
 
-    def __init__(self):
+    def __init__(self, encapsulation='ethernet', timezone=10800):
+        """
+        Parameters
+        ----------
+        timezone=10800
+            Time zone of datetime values passed to write_message(), see
+            parsers.file_parsers.TimeConverter (10800 = GMT+3)
+
+        encapsulation='ethernet'
+            'ethernet' - every message is wrapped into Ethernet/IPv4 and SCTP(+M3UA) or UDP
+                         headers, UDP messages need plugins/zte_fst.lua for decoding
+            'exported_pdu' - Wireshark Upper PDU link type (252), every message is
+                         prefixed only by the name of Wireshark dissector
+        """
+
+        if encapsulation != 'ethernet' and encapsulation != 'exported_pdu':
+            raise ValueError('Unknown pcap encapsulation: ' + encapsulation)
+        self.__encapsulation = encapsulation
+        self.__timezone = timezone
+        self.__time_converter = None
         self.__pcap_file = None
+        self.__own_file = True
 
         #Global header for pcap 2.4
         self.__pcap_global_header =  ('D4 C3 B2 A1'
@@ -17,173 +306,62 @@ class Pcap:
                                     '00 00 00 00'
                                     '00 00 00 00'
                                     'FF FF 00 00'
-                                    '01 00 00 00')
-
-        #pcap packet header that must preface every packet
-        #pcap_packet_header =   ('SS SS SS SS'   #Time sec
-        #                        'US US US US'   #Time usec
-        #                        'XX XX XX XX'   #Frame Size (little endian)
-        #                        'YY YY YY YY')  #Frame Size (little endian)
-        self.__pcap_packet_header = '{sec}{usec}{fs1}{fs2}'
-
-        #eth_header = ('00 00 00 00 00 00'     #Source Mac
-        #              '00 00 00 00 00 00'     #Dest Mac
-        #              '08 00')                #Protocol (0x0800 = IP)
-        self.__eth_header = '0000000000000000000000000800'
-
-        #ip_header = ('45'                    #IP version and header length (multiples of 4 bytes)
-        #             '00'
-        #             'XX XX'                 #Length - will be calculated and replaced later
-        #             '00 00'
-        #             '40 00 40'
-        #             '84'                    #Protocol (0x84 = SCTP)
-        #             'YY YY'                 #Checksum - will be calculated and replaced later
-        #             '7F 00 00 01'           #Source IP (Default: 127.0.0.1)
-        #             '7F 00 00 02')          #Dest IP (Default: 127.0.0.2)
-        self.__ip_header = '4500XXXX0000400040{protocol}YYYY{sourceIP}{destIP}'
-
-        #udp_header =   ('P1 P1'                 #Src Port - will be replaced later
-        #                'P2 P2'                 #Dest Port - will be replaced later
-        #                'YY YY'                 #Length - will be calculated and replaced later
-        #                '00 00')
-        self.__udp_header = '{src_port}{dst_port}{length}0000'
-
-        #sctp_header =   ('0b 59 0b 59 0e b0 00 2c 30 38 68 af 00 03' #ZZ ZZ - Chunk length
-        #   'ZZ ZZ TT TT TT TT 00 0b SS SS PP PP PP PP' )     #TT TT TT TT - Transmission sequence number
-        #                                                     #SS SS - = Stream sequence number
-        #                                                     #PP PP PP PP - Payload protocol identifier
-        self.__sctp_header = ('0b590b590eb0002c303868af0003'
-           '{len_chunk}{tsn}000b{ssn}{protocol}')
-
-        #m3ua_header =   ('01 00'
-        #   '01 01 MM MM MM MM 02 00 00 08 00 00 00 08 02 10' #MM MM MM MM - = MTP3 Message length (must be multiple of 4)
-        #   'PL PL OP OP OP OP DP DP DP DP 03 02 00 0a 06 12' #OP OP OP OP - = MTP3 OPC
-        #   '96 07 00 01 16' )                               #DP DP DP DP - = MTP3 DPC
-        #                                                     #PL PL - SS7 Message length = 23 + Message Length
-        self.__m3ua_header = ('0100'
-           '0101{len_mtp3}02000008000000080210'
-           '{len_ss7}{opc}{dpc}0302000a0612'
-           '9607000116')
+                                    '{linktype}')   #Link type (1 - Ethernet, 252 - Wireshark Upper PDU)
+        self.__pcap_global_header = self.__pcap_global_header.format(
+            linktype='01 00 00 00' if encapsulation == 'ethernet' else 'FC 00 00 00')
 
         self.__sctp_tsn = 0
         self.__sctp_ssn = 0
 
-        self.__ip_to_hex('127.0.0.1')
-
-
-    def write_message(self, msg_hex:str, time:datetime, protocol:str, pcap_data:dict):
-        sec = int((time - datetime.datetime(1970,1,1)).total_seconds()) -10800 #GMT+3
-        sec = self.__guint32(sec)
-        usec = self.__guint32(time.microsecond)
 
+    def write_message(self, msg_hex:str, time, protocol:str, pcap_data:dict):
+        #time: (sec, usec) in Unix time (e.g. from TimeConverter.toPcapTime()) or
+        #local datetime in the time zone given to the constructor.
+        #The encapsulation is built for every message, use write_encapsulated()
+        #with EncapsulationTable for many messages
+        if isinstance(time, tuple):
+            sec, usec = time
+        else:
+            if isinstance(self.__timezone, int):
+                sec = int((time - datetime.datetime(1970,1,1)).total_seconds()) - self.__timezone
+            else:
+                if self.__time_converter == None:
+                    self.__time_converter = TimeConverter(self.__timezone)
+                sec = self.__time_converter.toUnix(int((time - datetime.datetime(2000,1,1)).total_seconds()))
+            usec = time.microsecond
 
-        if protocol == 'UM':  #Add additional Byte of MAC HEADER for proper decoding by Wireshark
-            if pcap_data['pocedureName'] == 'RLC-MAC-DOWN':
-                msg_hex = '51' +  msg_hex
-            elif pcap_data['pocedureName'] == 'RLC-MAC-UP':
-                msg_hex = '50' +  msg_hex
+        self.write_encapsulated(Encapsulation(protocol, pcap_data), bytes.fromhex(msg_hex), sec, usec)
 
-        len_msg = self.__getByteLength(msg_hex)
-        len_padding = 0
 
-        # RANAP, A
-        if protocol == 'RANAP' or protocol == 'A':
-            ip_protocol = '84' #sctp
-            len_ss7_msg = 23 +  len_msg
-            len_padding = (len_ss7_msg)%4
-            if len_padding != 0:
-                len_padding = 4 - len_padding
-            len_mtp3_msg = 16 + len_ss7_msg + len_padding
-            len_chunk = 16 + len_mtp3_msg
-            m3ua_header = self.__m3ua_header.format(len_mtp3=self.__guint32(len_mtp3_msg),
-                                                len_ss7=self.__guint16(len_ss7_msg),
-                                                opc=self.__guint32(pcap_data['opc']),
-                                                dpc=self.__guint32(pcap_data['dpc']))
-            sctp_header = self.__prepare_sctp_header(len_chunk, 3)
-            sctp_header += m3ua_header
-            len_sctp = 12 + len_chunk
-            len_ip = 20 + len_sctp
-        # NBAP
-        elif protocol == 'NBAP':
-            ip_protocol = '84' #sctp
-            len_padding = (len_msg)%4
-            if len_padding != 0:
-                len_padding = 4 - len_padding
-            #len_chunk = 16 + len_msg + len_padding
-            len_chunk = 16 + len_msg
-            sctp_header = self.__prepare_sctp_header(len_chunk, 25)
-            len_chunk += len_padding
-            len_sctp = 12 + len_chunk
-            len_ip = 20 + len_sctp
-        # UU RRC
-        elif protocol == 'UU' or protocol == 'Abis' or protocol == 'UM' or protocol == 'RNSAP':
-            ip_protocol = '11' #udp
-            port = 999
-            if protocol == 'RNSAP':
-                port = 5005
-            else:
-                if   pcap_data['pocedureName'] == 'DL DCCH':
-                    port = 5000
-                elif pcap_data['pocedureName'] == 'DL CCCH':
-                    port = 5001
-                elif pcap_data['pocedureName'] == 'UL DCCH':
-                    port = 5002
-                elif pcap_data['pocedureName'] == 'UL CCCH':
-                    port = 5003
-                elif pcap_data['pocedureName'] == 'BCCH FACH':
-                    port = 5004
-                elif pcap_data['pocedureName'] == 'PCCH':
-                    port = 5006
-                elif pcap_data['pocedureName'] == 'Abis':
-                    port = 5100
-                elif pcap_data['pocedureName'] == 'RLC-MAC-UP':
-                    port = 5102
-                elif pcap_data['pocedureName'] == 'RLC-MAC-DOWN':
-                    port = 5103
-                elif pcap_data['pocedureName'] == 'LLC':
-                    port = 5104
-            len_udp = 8 + len_msg
-            udp_header = self.__udp_header.format(src_port=self.__guint16(port),
-                                        dst_port=self.__guint16(port),
-                                        length=self.__guint16(len_udp))
-            len_ip = 20 + len_udp
-
-        ip = self.__ip_header.format(protocol=ip_protocol, sourceIP=self.__ip_to_hex(pcap_data['source_ip']),
-                                    destIP=self.__ip_to_hex(pcap_data['dest_ip']))
-        ip = ip.replace('XXXX',self.__guint16(len_ip))
-        checksum = self.__ip_checksum(ip.replace('YYYY','0000'))
-        ip = ip.replace('YYYY',self.__guint16(checksum))
-
-        len_pcap = len_ip + 14
-        reverse_hex_str = self.__reverse_guint32(self.__guint32(len_pcap))
-        pcaph = self.__pcap_packet_header.format(sec=self.__reverse_guint32(sec),
-                                                usec=self.__reverse_guint32(usec),
-                                                fs1=reverse_hex_str,
-                                                fs2=reverse_hex_str)
-
-        if protocol == 'RANAP' or protocol == 'NBAP' or protocol == 'A':
-            bytestring = (pcaph + self.__eth_header + ip + sctp_header + msg_hex)
-            if len_padding != 0:
-                bytestring += '00'* len_padding
-        elif protocol == 'UU' or protocol == 'Abis' or protocol == 'UM' or protocol == 'RNSAP':
-            bytestring = (pcaph + self.__eth_header + ip + udp_header + msg_hex)
+    def write_encapsulated(self, encapsulation:Encapsulation, msg:bytes, sec:int, usec:int):
+        #encapsulation: from EncapsulationTable.lookup(), sec, usec: Unix time
+        if self.__encapsulation == 'exported_pdu':
+            self.__pcap_file.write(encapsulation.exported_pdu_frame(msg, sec, usec))
         else:
-            raise Exception('Help!')
+            self.__pcap_file.write(encapsulation.ethernet_frame(msg, sec, usec, self.__sctp_tsn, self.__sctp_ssn))
+            self.__sctp_tsn += 1
 
-        self.__write(bytestring)
 
-        self.__sctp_tsn += 1
+    def open(self, filename:str, tsn=1, ssn=1, compression=None):
+        #compression: None, 'gzip', 'zstd' or 'lz4' (see parsers.compress), the extension is added to filename
+        self.open_stream(open_output(filename, compression), tsn, ssn)
+        self.__own_file = True
 
 
-    def open(self, filename:str, tsn=1, ssn=1):
-        self.__pcap_file = open(filename, 'wb')
+    def open_stream(self, stream, tsn=1, ssn=1):
+        #Write pcap to already opened binary stream (e.g. socket file), close() will not close it
+        self.__pcap_file = stream
+        self.__own_file = False
         self.__write(self.__pcap_global_header)
         self.__sctp_tsn = tsn
         self.__sctp_ssn = ssn
 
 
     def close(self):
-        self.__pcap_file.close()
+        if self.__own_file:
+            self.__pcap_file.close()
+        else:
+            self.__pcap_file.flush()
 
 
     def __write(self, bytestring:str):
@@ -192,51 +370,6 @@ class Pcap:
         self.__pcap_file.write(bytes)
 
 
-    def __getByteLength(self, s:str) -> int:
-        return int(len(''.join(s.split())) / 2)
-
-
-    def __reverse_guint32(self, str_hex:str) -> str:
-        return str_hex[6:] + str_hex[4:6] + str_hex[2:4] + str_hex[:2]
-
-
-    def __guint32(self, i:int) -> str:
-        return '{0:08x}'.format(i)
-
-
-    def __guint16(self, i:int) -> str:
-        return '{0:04x}'.format(i)
-
-
-    def __ip_to_hex(self, ip:str) -> str:
-        octets = ip.split('.')
-        return '{0:02x}{1:02x}{2:02x}{3:02x}'.format(int(octets[0]), int(octets[1]), int(octets[2]), int(octets[3]))
-
-
-    #Splits the string into a list of tokens every n characters
-    def __splitN(self, str1:str, n:int):
-        return [str1[start:start+n] for start in range(0, len(str1), n)]
-
-
-    #Calculates and returns the IP checksum based on the given IP Header
-    def __ip_checksum(self, iph:str):
-        #split into bytes
-        words =self.__splitN(''.join(iph.split()),4)
-        csum = 0;
-        for word in words:
-            csum += int(word, base=16)
-        csum += (csum >> 16)
-        csum = csum & 0xFFFF ^ 0xFFFF
-
-        return csum
-
-    def __prepare_sctp_header(self, len_chunk:int, protocol:int):
-        return self.__sctp_header.format(len_chunk=self.__guint16(len_chunk),
-                                                tsn=self.__guint32(self.__sctp_tsn),
-                                                ssn=self.__guint16(self.__sctp_ssn),
-                                                protocol=self.__guint32(protocol))
-
-
   # https://www.codeproject.com/Tips/612847/Generate-a-quick-and-easy-custom-pcap-file-using-P
 
 
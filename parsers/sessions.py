@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+This module contains the class for reassembling calls/sessions of subscribers
+from data records spread over one or many FST files
+"""
+from collections import OrderedDict
+
+
+#(protocolType, procedureType, messageType) of the vendor messages which start and end the session
+UE_START_MESSAGES = {(100, 0, 0)}
+UE_END_MESSAGES = {(100, 0, 1), (100, 11, 111)}
+
+
+class SessionTracker:
+    """
+    Session reassembly table
+
+    Records are grouped by GlobalCallId (by IMSI if GlobalCallId is 0). A
+    session is finished when its UE End message arrives, when UE Start of a new
+    session with the same key arrives, or when no record of the session was
+    seen for timeout seconds of trace time (the newest message time seen is the
+    current time), so only active sessions are kept in memory. Sessions are
+    split only between records: a record with UE Start belongs to the new
+    session as a whole.
+
+    Finished session is a dict:
+        {'number' (sequence number of the session in the tracker),
+         'GlobalCallId', 'imsi', 'start', 'end' (ZTE times in milliseconds),
+         'duration' (seconds), 'records', 'messages',
+         'protocols' ({protocolType: messages}), 'cells' (sorted AccessCellId
+         and serviceCellId values), 'reason' ('ue_end', 'restart', 'timeout' or
+         'end_of_data'), 'recordList' (data records, only if keepRecords)}
+    """
+
+    def __init__(self, timeout = 600, keepRecords = False):
+        """
+        Parameters
+        ----------
+        timeout = 600
+            Seconds of trace time without records after which a session is evicted
+
+        keepRecords = False
+            Keep data records of the session in 'recordList' (e.g. for writing
+            pcap-file of the session). Memory grows with the number of records
+            of active sessions
+        """
+
+        self.__timeout = timeout * 1000
+        self.__keepRecords = keepRecords
+        self.__sessions = OrderedDict()   # key -> session, least recently updated first
+        self.__newest = 0
+        self.__finished = 0
+        self.__started = 0
+
+
+    def add(self, record: dict) -> list:
+        """
+        Add data record returned by FstParser.readRecords() with decoded content.
+        Message times are the clock of the timeouts, so records without
+        decoded content never evict sessions
+
+        Returns
+        -------
+        list
+            Sessions finished by this record (in order they were finished)
+        """
+
+        header = record['recordHeader']
+        ueIdInfo = header['ueIdInfo']
+        key = ueIdInfo['GlobalCallId'] if ueIdInfo['GlobalCallId'] != 0 else ueIdInfo['ImsiElement']
+        finished = list()
+
+        # The whole record belongs to one session: if it contains UE Start, the
+        # previous session of the key is finished before the record
+        types = [(m['header']['protocolType'], m['header']['procedureType'], m['header']['messageType']) for m in record['recordContent']]
+        starts = [i for i, t in enumerate(types) if t in UE_START_MESSAGES]
+        session = self.__sessions.get(key)
+        if session != None:
+            self.__sessions.move_to_end(key)
+            if len(starts) > 0:
+                del self.__sessions[key]
+                finished.append(self.__finish(session, 'restart'))
+                session = None
+        if session == None:
+            session = self.__new_session(ueIdInfo)
+            self.__sessions[key] = session
+
+        for i, message in enumerate(record['recordContent']):
+            h = message['header']
+            time = h['second'] * 1000 + h['quatMillisecond'] * 4
+            if session['start'] == None or time < session['start']:
+                session['start'] = time
+            if session['end'] == None or time > session['end']:
+                session['end'] = time
+            if time > self.__newest:
+                self.__newest = time
+            session['messages'] += 1
+            session['protocols'][h['protocolType']] = session['protocols'].get(h['protocolType'], 0) + 1
+            session['cells'].add(h['serviceCellId'])
+            # UE End before UE Start in the same record does not end the new session
+            if types[i] in UE_END_MESSAGES and (len(starts) == 0 or i > starts[-1]):
+                session['ended'] = True
+
+        if self.__keepRecords:
+            session['recordList'].append(record)
+        session['records'] += 1
+        session['cells'].add(ueIdInfo['AccessCellId'])
+        session['lastSeen'] = self.__newest
+        if session['ended']:
+            del self.__sessions[key]
+            finished.append(self.__finish(session, 'ue_end'))
+
+        # Evict inactive sessions
+        while len(self.__sessions) > 0:
+            oldest = next(iter(self.__sessions.values()))
+            if oldest['lastSeen'] >= self.__newest - self.__timeout:
+                break
+            self.__sessions.popitem(last=False)
+            finished.append(self.__finish(oldest, 'timeout'))
+        return finished
+
+
+    def track(self, records, onSession):
+        """
+        Add all records and pass them through, so the tracker can be chained
+        with other record consumers. Sessions still open after the last record
+        are not finished, see flush()
+
+        Parameters
+        ----------
+        records:
+            Iterable of data records, e.g. FstParser.readRecords()
+
+        onSession:
+            Function called with every finished session
+        """
+
+        for record in records:
+            for session in self.add(record):
+                onSession(session)
+            yield record
+
+
+    def flush(self) -> list:
+        """
+        Finish all open sessions (at the end of the data)
+
+        Returns
+        -------
+        list
+            Finished sessions
+        """
+
+        finished = [self.__finish(session, 'end_of_data') for session in self.__sessions.values()]
+        self.__sessions.clear()
+        return finished
+
+
+    def stats(self) -> dict:
+        """
+        Returns
+        -------
+        dict
+            {'active': sessions in memory, 'finished': finished sessions}
+        """
+
+        return {'active': len(self.__sessions), 'finished': self.__finished}
+
+
+    def __new_session(self, ueIdInfo: dict) -> dict:
+        self.__started += 1
+        return {'number': self.__started, 'GlobalCallId': ueIdInfo['GlobalCallId'], 'imsi': ueIdInfo['ImsiElement'], 'start': None, 'end': None,
+                'records': 0, 'messages': 0, 'protocols': dict(), 'cells': set(), 'ended': False,
+                'lastSeen': 0, 'recordList': list()}
+
+
+    def __finish(self, session: dict, reason: str) -> dict:
+        self.__finished += 1
+        del session['ended']
+        del session['lastSeen']
+        if not self.__keepRecords:
+            del session['recordList']
+        session['reason'] = reason
+        session['cells'] = sorted(session['cells'])
+        session['duration'] = (session['end'] - session['start']) / 1000 if session['start'] != None else 0
+        return session
+
+
+if __name__ == '__main__':
+    print('Module sessions.py is not main application')
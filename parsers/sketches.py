@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+This module contains the streaming structures for finding heavy hitters (chatty
+IMSIs and loaded cells) in bounded memory: count-min sketch, space-saving top-K
+and the analytics stage built on them
+"""
+import json
+import heapq
+import hashlib
+from array import array
+
+
+class CountMinSketch:
+    """
+    Count-min sketch: approximate counters for any number of keys in fixed memory.
+    Estimates are never lower than the real counts. Every row has its own hash
+    from the pairwise independent family ((a * h + b) mod p) mod width over the
+    64-bit blake2b hash h of the key, so an estimate exceeds the real count by
+    more than 2/width of the total count with probability at most 0.5^depth.
+    Sketches with the same width and depth can be merged (also across processes,
+    hashing does not depend on the process).
+    """
+
+    HASH = 'blake2b-mod61'
+    __PRIME = (1 << 61) - 1
+
+    def __init__(self, width = 4096, depth = 4):
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.__rows = [array('Q', bytes(8 * width)) for i in range(depth)]
+        # Fixed (a, b) of every row, derived from the row number
+        self.__coefficients = list()
+        for i in range(depth):
+            digest = hashlib.blake2b(str(i).encode(), digest_size=16, person=b'fst-cms-row').digest()
+            self.__coefficients.append((int.from_bytes(digest[:8], 'little') % (self.__PRIME - 1) + 1,
+                                        int.from_bytes(digest[8:], 'little') % self.__PRIME))
+
+
+    def add(self, key: str, count = 1) -> int:
+        """
+        Returns
+        -------
+        int
+            Estimate of the key after adding, the same as estimate(key)
+        """
+
+        self.total += count
+        result = None
+        for row, column in zip(self.__rows, self.__columns(key)):
+            row[column] += count
+            if result == None or row[column] < result:
+                result = row[column]
+        return result
+
+
+    def estimate(self, key: str) -> int:
+        return min(row[column] for row, column in zip(self.__rows, self.__columns(key)))
+
+
+    def merge(self, other):
+        if other.width != self.width or other.depth != self.depth:
+            raise ValueError('Count-min sketches of different size can not be merged')
+        self.total += other.total
+        for row, other_row in zip(self.__rows, other.__rows):
+            for i in range(self.width):
+                row[i] += other_row[i]
+
+
+    def to_dict(self) -> dict:
+        return {'width': self.width, 'depth': self.depth, 'hash': self.HASH, 'total': self.total,
+                'rows': [row.tolist() for row in self.__rows]}
+
+
+    @staticmethod
+    def from_dict(d: dict):
+        if d.get('hash') != CountMinSketch.HASH:
+            raise ValueError('Count-min sketch was saved with other hashing ({0}) and can not be loaded'.format(d.get('hash')))
+        sketch = CountMinSketch(d['width'], d['depth'])
+        sketch.total = d['total']
+        sketch.__rows = [array('Q', row) for row in d['rows']]
+        return sketch
+
+
+    def __columns(self, key: str):
+        h = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+        return [((a * h + b) % self.__PRIME) % self.width for a, b in self.__coefficients]
+
+
+class SpaceSaving:
+    """
+    Space-saving top-K: keeps at most k counters. A new key replaces the key
+    with the smallest counter and inherits its count, so counts of the kept keys
+    may be overestimated by at most the smallest counter.
+    If the count-min estimate of the key is given to add(), it is used as the
+    counter and a new key replaces the smallest one only if its estimate is
+    larger, which keeps the real top keys also for flat distributions.
+    """
+
+    def __init__(self, k = 100):
+        self.k = k
+        self.__counters = dict()   # key -> count
+        self.__heap = list()       # (count, key), may contain outdated entries
+
+
+    def add(self, key: str, count = 1, estimate = None):
+        if key in self.__counters:
+            self.__counters[key] = self.__counters[key] + count if estimate == None else estimate
+        elif len(self.__counters) < self.k:
+            self.__counters[key] = count if estimate == None else estimate
+        else:
+            minimum, minimum_key = self.__minimum()
+            if estimate == None:
+                estimate = minimum + count
+            elif estimate <= minimum:
+                return
+            heapq.heappop(self.__heap)
+            del self.__counters[minimum_key]
+            self.__counters[key] = estimate
+        heapq.heappush(self.__heap, (self.__counters[key], key))
+        if len(self.__heap) > 4 * self.k:
+            self.__heap = [(c, k) for k, c in self.__counters.items()]
+            heapq.heapify(self.__heap)
+
+
+    def top(self, n = None) -> list:
+        """
+        Returns
+        -------
+        list
+            [(key, count), ...] sorted by count descending
+        """
+
+        return sorted(self.__counters.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+    def merge(self, other, estimate = None):
+        #Counters of both summaries are added (or taken from estimate(key) of the
+        #merged count-min sketch), then only the k largest are kept
+        counters = dict(self.__counters)
+        for key, count in other.__counters.items():
+            counters[key] = counters.get(key, 0) + count
+        if estimate != None:
+            counters = {key: estimate(key) for key in counters}
+        self.__counters = dict(sorted(counters.items(), key=lambda item: item[1], reverse=True)[:self.k])
+        self.__heap = [(c, k) for k, c in self.__counters.items()]
+        heapq.heapify(self.__heap)
+
+
+    def to_dict(self) -> dict:
+        return {'k': self.k, 'counters': self.__counters}
+
+
+    @staticmethod
+    def from_dict(d: dict):
+        summary = SpaceSaving(d['k'])
+        for key, count in d['counters'].items():
+            summary.__counters[key] = count
+        summary.__heap = [(c, k) for k, c in summary.__counters.items()]
+        heapq.heapify(summary.__heap)
+        return summary
+
+
+    def __minimum(self) -> tuple:
+        #Outdated heap entries are dropped until the top one is the current counter
+        while True:
+            count, key = self.__heap[0]
+            if self.__counters.get(key) == count:
+                return count, key
+            heapq.heappop(self.__heap)
+
+
+class HeavyHitters:
+    """
+    Streaming heavy-hitter analytics over data records
+
+    For every dimension ('imsi', 'accessCell', 'serviceCell') and metric
+    ('messages', 'bytes') keeps a count-min sketch (approximate count of any key)
+    and a space-saving top-K. 'bytes' is the sum of message raw data lengths
+    (RecordContentLength if records content is not decoded).
+    Instances can be merged, saved to and loaded from json-file, so results of
+    several files, runs or processes can be combined. 'files' is the set of
+    source files already counted, kept by the caller, so a file is not counted
+    twice when results of several runs are merged.
+    """
+
+    DIMENSIONS = ('imsi', 'accessCell', 'serviceCell')
+    METRICS = ('messages', 'bytes')
+
+    def __init__(self, k = 100, width = 16384, depth = 4):
+        """
+        Parameters
+        ----------
+        k = 100
+            Number of counters of every top-K
+
+        width = 16384, depth = 4
+            Size of every count-min sketch (8 * width * depth bytes). Counts are
+            overestimated by more than 2/width of the total with probability at most 0.5^depth
+        """
+
+        self.records = 0
+        self.files = set()
+        self.__sketches = {(d, m): CountMinSketch(width, depth) for d in self.DIMENSIONS for m in self.METRICS}
+        self.__tops = {(d, m): SpaceSaving(k) for d in self.DIMENSIONS for m in self.METRICS}
+
+
+    def update(self, record: dict):
+        """
+        Add data record returned by FstParser.readRecords()
+        """
+
+        self.records += 1
+        header = record['recordHeader']
+        messages = header['MessageCount']
+        if len(record['recordContent']) > 0:
+            length = 0
+            for message in record['recordContent']:
+                cell = str(message['header']['serviceCellId'])
+                self.__add('serviceCell', cell, 1, message['header']['rawDataLength'])
+                length += message['header']['rawDataLength']
+        else:
+            length = header['RecordContentLength']
+        self.__add('imsi', header['ueIdInfo']['ImsiElement'], messages, length)
+        self.__add('accessCell', str(header['ueIdInfo']['AccessCellId']), messages, length)
+
+
+    def feed(self, records, reportEvery = 0, n = 10):
+        """
+        Update with all records and pass them through, so the stage can be
+        chained with other record consumers
+
+        Parameters
+        ----------
+        records:
+            Iterable of data records, e.g. FstParser.readRecords()
+
+        reportEvery = 0
+            Print report every reportEvery records (0 - no periodic reports)
+
+        n = 10
+            Number of top keys in periodic reports
+        """
+
+        for record in records:
+            self.update(record)
+            if reportEvery > 0 and self.records % reportEvery == 0:
+                print(self.format_report(n))
+            yield record
+
+
+    def estimate(self, dimension: str, metric: str, key: str) -> int:
+        return self.__sketches[(dimension, metric)].estimate(key)
+
+
+    def report(self, n = 10) -> dict:
+        """
+        Returns
+        -------
+        dict
+            {dimension: {metric: [(key, count), ...]}}, count is the smaller of
+            space-saving and count-min estimates
+        """
+
+        result = dict()
+        for (dimension, metric), top in self.__tops.items():
+            sketch = self.__sketches[(dimension, metric)]
+            #Both counts are overestimates, the smaller one is closer to the real count
+            counts = [(key, min(count, sketch.estimate(key))) for key, count in top.top()]
+            result.setdefault(dimension, dict())[metric] = sorted(counts, key=lambda item: item[1], reverse=True)[:n]
+        return result
+
+
+    def format_report(self, n = 10) -> str:
+        lines = ['Heavy hitters after {0} records:'.format(self.records)]
+        for dimension, metrics in self.report(n).items():
+            for metric, top in metrics.items():
+                lines.append('\tTop {0} by {1}: '.format(dimension, metric) +
+                             ', '.join('{0}={1}'.format(key, count) for key, count in top))
+        return '\n'.join(lines)
+
+
+    def merge(self, other):
+        self.records += other.records
+        self.files |= other.files
+        for key in self.__sketches:
+            self.__sketches[key].merge(other.__sketches[key])
+            self.__tops[key].merge(other.__tops[key], self.__sketches[key].estimate)
+
+
+    def save(self, file: str):
+        d = {'records': self.records, 'files': sorted(self.files),
+             'sketches': {'{0}/{1}'.format(*key): s.to_dict() for key, s in self.__sketches.items()},
+             'tops': {'{0}/{1}'.format(*key): t.to_dict() for key, t in self.__tops.items()}}
+        with open(file, 'w') as f:
+            json.dump(d, f)
+
+
+    @staticmethod
+    def load(file: str):
+        with open(file) as f:
+            d = json.load(f)
+        hh = HeavyHitters()
+        hh.records = d['records']
+        hh.files = set(d.get('files', list()))
+        for key in hh.__sketches:
+            name = '{0}/{1}'.format(*key)
+            hh.__sketches[key] = CountMinSketch.from_dict(d['sketches'][name])
+            hh.__tops[key] = SpaceSaving.from_dict(d['tops'][name])
+        return hh
+
+
+    def __add(self, dimension: str, key: str, messages: int, length: int):
+        for metric, count in (('messages', messages), ('bytes', length)):
+            estimate = self.__sketches[(dimension, metric)].add(key, count)
+            self.__tops[(dimension, metric)].add(key, count, estimate)
+
+
+if __name__ == '__main__':
+    print('Module sketches.py is not main application')
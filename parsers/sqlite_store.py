@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+This module contains the class for bulk loading parsed FST files into a local
+SQLite database for ad-hoc queries
+"""
+import sqlite3
+from parsers.dict_parsers import search_for_message, search_for_direction
+
+
+_TABLES = (
+    '''CREATE TABLE IF NOT EXISTS files (
+        file_id INTEGER PRIMARY KEY, path TEXT UNIQUE, ElementId INTEGER, ElementMode INTEGER,
+        FileType INTEGER, ElementVersion TEXT, FileStartTimestamp TEXT, FileEndTimestamp TEXT,
+        FileRecordNumber INTEGER, FileNo INTEGER)''',
+    '''CREATE TABLE IF NOT EXISTS records (
+        record_id INTEGER PRIMARY KEY, file_id INTEGER, rec INTEGER, GlobalCallId INTEGER,
+        ImsiLength INTEGER, AccessCellId INTEGER, Imsi TEXT, SourceId INTEGER, RecordType INTEGER,
+        MessageCount INTEGER, RecordSequence INTEGER, firstTime REAL, lastTime REAL,
+        recordTlvData BLOB, recordRawContent BLOB)''',
+    '''CREATE TABLE IF NOT EXISTS messages (
+        record_id INTEGER, msg INTEGER, protocolType INTEGER, procedureType INTEGER, messageType INTEGER,
+        protocolName TEXT, procedureName TEXT, messageName TEXT, direction INTEGER, directionName TEXT,
+        time REAL, localTime TEXT, serviceCellId INTEGER, messageSequence INTEGER,
+        tlvData BLOB, rawData BLOB)''',
+)
+
+#Used for replacing data of a reloaded file, never dropped
+_KEY_INDEXES = (
+    ('records_file_id', 'records(file_id)'),
+    ('messages_record_id', 'messages(record_id)'),
+)
+
+_QUERY_INDEXES = (
+    ('records_imsi', 'records(Imsi)'),
+    ('records_global_call_id', 'records(GlobalCallId)'),
+    ('records_access_cell_id', 'records(AccessCellId)'),
+    ('records_first_time', 'records(firstTime)'),
+    ('messages_service_cell_id', 'messages(serviceCellId)'),
+    ('messages_time', 'messages(time)'),
+    ('messages_name', 'messages(messageName)'),
+)
+
+
+class TraceStore:
+    """
+    SQLite trace store
+
+    Tables: files, records (one row per data record, Imsi, GlobalCallId, cells,
+    first/last message time) and messages (one row per message with names
+    resolved from the dictionaries, 'time' is Unix time in UTC, 'localTime' is
+    the FST time as in the decoded text file, payloads are BLOBs).
+    GlobalCallId is stored as signed 64-bit integer (values above 2^63-1 become
+    negative), as SQLite has no unsigned integers.
+
+    Loading is done in one transaction per file with executemany() batches.
+    If the database is empty, open() drops the query indexes and close()
+    creates them, so that they are built once after the initial bulk load.
+    Incremental loads into a filled database keep all indexes. Indexes on
+    records(file_id) and messages(record_id) are never dropped, they are used
+    for replacing data of a reloaded file. Indexes missing after an
+    interrupted load are created by the next close().
+    """
+
+    def __init__(self, dictionaries: dict, timeConverter, batchSize = 10000):
+        """
+        Parameters
+        ----------
+        dictionaries: dict
+            Loaded dictionaries: {'messages', 'protocols', 'directions_2g', 'directions_3g'}
+
+        timeConverter: parsers.file_parsers.TimeConverter
+            Converter with the time zone of the FST files
+
+        batchSize = 10000
+            Number of rows inserted by one executemany()
+        """
+
+        self.__dictionaries = dictionaries
+        self.__timeConverter = timeConverter
+        self.__batchSize = batchSize
+        self.__db = None
+        self.__names = dict()       # (protocolType, procedureType, messageType) -> search_for_message()
+        self.__directions = dict()  # (ElementMode, direction) -> name
+        self.__fileId = None
+        self.__elementMode = None
+        self.__nextRecordId = 1
+        self.__records = list()
+        self.__messages = list()
+
+
+    def open(self, filename: str):
+        self.__db = sqlite3.connect(filename)
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('PRAGMA synchronous=NORMAL')
+        for table in _TABLES:
+            self.__db.execute(table)
+        for name, columns in _KEY_INDEXES:
+            self.__db.execute('CREATE INDEX IF NOT EXISTS {0} ON {1}'.format(name, columns))
+        if self.__db.execute('SELECT NOT EXISTS (SELECT 1 FROM records)').fetchone()[0]:
+            for name, columns in _QUERY_INDEXES:
+                self.__db.execute('DROP INDEX IF EXISTS ' + name)
+        self.__db.commit()
+        self.__nextRecordId = self.__db.execute('SELECT IFNULL(MAX(record_id), 0) + 1 FROM records').fetchone()[0]
+
+
+    def begin_file(self, path: str, fileInfo: dict):
+        """
+        Start loading of the FST file, previously loaded data of the same file is replaced
+
+        Parameters
+        ----------
+        path: str
+            Full path to the FST data file
+
+        fileInfo: dict
+            File header returned by FstParser.open()
+        """
+
+        self.__db.execute('BEGIN')
+        row = self.__db.execute('SELECT file_id FROM files WHERE path = ?', (path,)).fetchone()
+        if row != None:
+            self.__db.execute('DELETE FROM messages WHERE record_id IN (SELECT record_id FROM records WHERE file_id = ?)', row)
+            self.__db.execute('DELETE FROM records WHERE file_id = ?', row)
+            self.__db.execute('DELETE FROM files WHERE file_id = ?', row)
+        cursor = self.__db.execute('INSERT INTO files (path, ElementId, ElementMode, FileType, ElementVersion, FileStartTimestamp, '
+                                   'FileEndTimestamp, FileRecordNumber, FileNo) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                   (path, fileInfo['ElementId'], fileInfo['ElementMode'], fileInfo['FileType'], fileInfo['ElementVersion'],
+                                    str(fileInfo['FileStartTimestamp']), str(fileInfo['FileEndTimestamp']),
+                                    fileInfo['FileRecordNumber'], fileInfo['FileNo']))
+        self.__fileId = cursor.lastrowid
+        self.__elementMode = fileInfo['ElementMode']
+
+
+    def add_record(self, rec: int, record: dict):
+        """
+        Add data record returned by FstParser.readRecords()
+
+        Parameters
+        ----------
+        rec: int
+            Number of the data record in the file (the same as in the decoded text file)
+
+        record: dict
+            Data record
+        """
+
+        recordId = self.__nextRecordId
+        self.__nextRecordId += 1
+        header = record['recordHeader']
+        firstTime = None
+        lastTime = None
+        for i, message in enumerate(record['recordContent']):
+            h = message['header']
+            sec, usec = self.__timeConverter.toPcapTime(h['second'], h['quatMillisecond'])
+            time = sec + usec / 1000000
+            if firstTime == None or time < firstTime:
+                firstTime = time
+            if lastTime == None or time > lastTime:
+                lastTime = time
+            msg = self.__message_names(h['protocolType'], h['procedureType'], h['messageType'])
+            self.__messages.append((recordId, i, h['protocolType'], h['procedureType'], h['messageType'],
+                                    msg['protocolName'], msg['procedureName'], msg['messageName'],
+                                    h['direction'], self.__direction_name(h['direction']),
+                                    time, self.__timeConverter.toText(h['second'], h['quatMillisecond']),
+                                    h['serviceCellId'], h['messageSequence'],
+                                    self.__blob(message['tlvData']), self.__blob(message['rawData'])))
+
+        globalCallId = header['ueIdInfo']['GlobalCallId']
+        if globalCallId >= 1 << 63:
+            globalCallId -= 1 << 64
+        self.__records.append((recordId, self.__fileId, rec, globalCallId, header['ueIdInfo']['ImsiLength'],
+                               header['ueIdInfo']['AccessCellId'], header['ueIdInfo']['ImsiElement'], header['SourceId'],
+                               header['RecordType'], header['MessageCount'], header['RecordSequence'], firstTime, lastTime,
+                               self.__blob(record['recordTlvData']), self.__blob(record['recordRawContent'])))
+
+        if len(self.__records) >= self.__batchSize or len(self.__messages) >= self.__batchSize:
+            self.__flush()
+
+
+    def end_file(self):
+        """
+        Write the rest of the rows and commit the file
+        """
+
+        self.__flush()
+        self.__db.commit()
+        self.__fileId = None
+
+
+    def close(self):
+        """
+        Create missing indexes and close the database
+        """
+
+        for name, columns in _KEY_INDEXES + _QUERY_INDEXES:
+            self.__db.execute('CREATE INDEX IF NOT EXISTS {0} ON {1}'.format(name, columns))
+        self.__db.commit()
+        self.__db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.__db.close()
+
+
+    def __flush(self):
+        if len(self.__records) > 0:
+            self.__db.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.__records)
+            self.__records = list()
+        if len(self.__messages) > 0:
+            self.__db.executemany('INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.__messages)
+            self.__messages = list()
+
+
+    def __message_names(self, protocolType: int, procedureType: int, messageType: int) -> dict:
+        key = (protocolType, procedureType, messageType)
+        msg = self.__names.get(key)
+        if msg == None:
+            msg = search_for_message(self.__dictionaries['messages'], self.__dictionaries['protocols'],
+                                     protocolType, procedureType, messageType)
+            self.__names[key] = msg
+        return msg
+
+
+    def __direction_name(self, direction: int) -> str:
+        key = (self.__elementMode, direction)
+        name = self.__directions.get(key)
+        if name == None:
+            if self.__elementMode == 3:   # 3 - GSM
+                name = search_for_direction(self.__dictionaries['directions_2g'], direction)
+            elif self.__elementMode == 1: # 1 - UMTS
+                name = search_for_direction(self.__dictionaries['directions_3g'], direction)
+            else:
+                name = '?'
+            self.__directions[key] = name
+        return name
+
+
+    def __blob(self, hex_str: str):
+        if hex_str == '':
+            return None
+        return bytes.fromhex(hex_str)
+
+
+if __name__ == '__main__':
+    print('Module sqlite_store.py is not main application')
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+This module contains the class for keeping in memory IMSI/time indexes of the
+ZTE FST files of a trace directory and answering queries by IMSI and time range
+"""
+import os
+import glob
+import threading
+from collections import OrderedDict
+from parsers.file_parsers import FstParser, toZteSeconds
+
+
+class TraceIndex:
+    """
+    In-memory index of a trace directory
+
+    File headers (time range of every file) are kept for all files of the
+    directory. Per-file record indexes {IMSI: [(rec, offset, firstSecond, lastSecond)]}
+    are built by a fast header-only scan (FstParser.indexRecords()) and kept for
+    the maxIndexedFiles most recently used files (LRU eviction).
+    All times are ZTE seconds (since 01.01.2000) in the time zone of the files.
+    """
+
+    def __init__(self, directory: str, maxIndexedFiles = 300, timeSlack = 300, pattern = 'ZTE_FST_*.dat'):
+        """
+        Parameters
+        ----------
+        directory: str
+            Full path to the trace directory
+
+        maxIndexedFiles = 300
+            Maximum number of per-file record indexes kept in memory
+
+        timeSlack = 300
+            Seconds added to the file header time range when selecting files
+            for a query, as message times may slightly exceed it
+
+        pattern = 'ZTE_FST_*.dat'
+            Glob pattern of the FST files in the directory
+        """
+
+        self.__directory = directory
+        self.__maxIndexedFiles = maxIndexedFiles
+        self.__timeSlack = timeSlack
+        self.__pattern = pattern
+        self.__files = dict()            # path -> {'signature', 'fileInfo', 'start', 'end'}
+        self.__indexes = OrderedDict()   # path -> {IMSI: [(rec, offset, firstSecond, lastSecond)]}
+        self.__lock = threading.RLock()
+
+
+    def refresh(self) -> list:
+        """
+        Rescan the trace directory, read headers of new or changed files and
+        build their indexes, forget removed files
+
+        Returns
+        -------
+        list
+            New or changed files
+        """
+
+        paths = sorted(glob.glob(os.path.join(self.__directory, self.__pattern)))
+        with self.__lock:
+            for path in set(self.__files) - set(paths):
+                del self.__files[path]
+                self.__indexes.pop(path, None)
+            known = {path: f['signature'] for path, f in self.__files.items()}
+
+        # File headers are read without the lock, so queries are not blocked
+        new_files = dict()
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            signature = (st.st_size, st.st_mtime_ns)
+            if known.get(path) == signature:
+                continue
+            fstParser = FstParser()
+            try:
+                fileInfo = fstParser.open(path)
+            except Exception:
+                # File is still being written, try again on the next refresh
+                continue
+            finally:
+                fstParser.close()
+            new_files[path] = {'signature': signature, 'fileInfo': fileInfo,
+                               'start': toZteSeconds(fileInfo['FileStartTimestamp']),
+                               'end': toZteSeconds(fileInfo['FileEndTimestamp'])}
+
+        with self.__lock:
+            for path, f in new_files.items():
+                self.__files[path] = f
+                self.__indexes.pop(path, None)
+
+        # Keep the newest files hot
+        new_files = sorted(new_files, key=lambda path: (new_files[path]['start'], path))
+        for path in new_files[-self.__maxIndexedFiles:]:
+            try:
+                self.get_index(path)
+            except Exception as e:
+                print('!!!!!!! WARNING !!!!!!!\nFile: {0}\nIndexing failed: {1}\n!!!!!!! WARNING !!!!!!!'.format(path, e))
+        return new_files
+
+
+    def get_index(self, path: str) -> dict:
+        """
+        Return record index of the file, build it if it is not in memory.
+        The file is scanned without holding the lock, so other queries are
+        not blocked (two threads may build the same index at the same time)
+
+        Returns
+        -------
+        dict
+            {IMSI: [(rec, offset, firstSecond, lastSecond)]}
+        """
+
+        with self.__lock:
+            if path in self.__indexes:
+                self.__indexes.move_to_end(path)
+                return self.__indexes[path]
+            signature = self.__files[path]['signature'] if path in self.__files else None
+
+        index = dict()
+        fstParser = FstParser()
+        fstParser.open(path)
+        try:
+            for rec, item in enumerate(fstParser.indexRecords()):
+                index.setdefault(item['ImsiElement'], list()).append(
+                    (rec, item['offset'], item['firstSecond'], item['lastSecond']))
+        finally:
+            fstParser.close()
+
+        with self.__lock:
+            # Not cached if the file was changed or removed during the scan
+            if path in self.__files and self.__files[path]['signature'] == signature:
+                self.__indexes[path] = index
+                self.__indexes.move_to_end(path)
+                while len(self.__indexes) > self.__maxIndexedFiles:
+                    self.__indexes.popitem(last=False)
+        return index
+
+
+    def latest(self) -> int:
+        """
+        Returns
+        -------
+        int
+            The latest file end time of the directory or None if there are no files
+        """
+
+        with self.__lock:
+            if len(self.__files) == 0:
+                return None
+            return max(f['end'] for f in self.__files.values())
+
+
+    def file_info(self, path: str) -> dict:
+        with self.__lock:
+            return self.__files[path]['fileInfo']
+
+
+    def query(self, imsi: str, start: int, end: int) -> list:
+        """
+        Search for data records of the IMSI in the time range
+
+        Parameters
+        ----------
+        imsi: str
+            IMSI
+
+        start: int, end: int
+            Time range in ZTE seconds, None means no limit
+
+        Returns
+        -------
+        list
+            [(path, [(rec, offset), ...]), ...] sorted by file start time
+        """
+
+        with self.__lock:
+            files = sorted(((f['start'], path) for path, f in self.__files.items()
+                    if (start == None or f['end'] + self.__timeSlack >= start) and
+                       (end == None or f['start'] - self.__timeSlack <= end)))
+        result = list()
+        for file_start, path in files:
+            records = list()
+            for rec, offset, firstSecond, lastSecond in self.get_index(path).get(imsi, list()):
+                if firstSecond != None:
+                    if start != None and lastSecond < start:
+                        continue
+                    if end != None and firstSecond > end:
+                        continue
+                records.append((rec, offset))
+            if len(records) > 0:
+                result.append((path, records))
+        return result
+
+
+    def status(self) -> dict:
+        with self.__lock:
+            return {'directory': self.__directory, 'files': len(self.__files),
+                    'indexedFiles': len(self.__indexes), 'latest': self.latest()}
+
+
+if __name__ == '__main__':
+    print('Module trace_index.py is not main application')
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+This module contains the class for splitting FST files of a shared trace
+directory between several processing nodes
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+
+
+class WorkQueue:
+    """
+    Work queue on shared storage
+
+    Every file is claimed by creating the lease file '<file name>.lease' in the
+    queue directory with O_CREAT|O_EXCL, so exactly one node gets it. The owner
+    renews the lease (mtime of the lease file) from a background thread. A lease
+    not renewed for leaseTimeout seconds belongs to a dead node and is
+    reclaimed: it is renamed to a unique name first, so only one node removes
+    it. When the file is processed, the node writes the completion record
+    '<file name>.done.json' (temporary file and rename) and removes the lease.
+    Every lease holds a random token of its owner, the lease is renewed and
+    removed only while it still holds the token, so a node whose lease was
+    reclaimed does not touch the lease of the new owner.
+
+    Files are identified by the file name, as the share may be mounted under
+    different paths on different nodes. Lease times are compared with the local
+    clock, so clocks of the nodes have to be synchronized much better than
+    leaseTimeout.
+    """
+
+    def __init__(self, directory: str, leaseTimeout = 600, node = None):
+        """
+        Parameters
+        ----------
+        directory: str
+            Queue directory on the shared storage (created if missing)
+
+        leaseTimeout = 600
+            Seconds after which the lease of a node which stopped renewing it is reclaimed
+
+        node = None
+            Name of the node written to leases and completion records,
+            default is '<host name>:<process id>'
+        """
+
+        self.__directory = directory
+        self.__leaseTimeout = leaseTimeout
+        self.__node = node if node != None else '{0}:{1}'.format(socket.gethostname(), os.getpid())
+        self.__leases = dict()   # lease file -> token of this node
+        self.__lock = threading.Lock()
+        self.__heartbeat = None
+        os.makedirs(directory, exist_ok=True)
+
+
+    def claim(self, source_file: str) -> bool:
+        """
+        Try to take the file for processing by this node
+
+        Returns
+        -------
+        bool
+            True if the file is leased by this node, False if it is already
+            done or leased by another node
+        """
+
+        name = os.path.basename(source_file)
+        if os.path.exists(self.__done_file(name)):
+            return False
+        lease_file = self.__lease_file(name)
+        token = uuid.uuid4().hex
+        for attempt in range(2):
+            try:
+                fd = os.open(lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if attempt > 0 or not self.__reclaim(lease_file):
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'node': self.__node, 'token': token, 'claimed': time.time()}, f)
+            break
+
+        # The file could be completed by another node between the check and the lease
+        if os.path.exists(self.__done_file(name)):
+            self.__remove_lease(lease_file, token)
+            return False
+        with self.__lock:
+            self.__leases[lease_file] = token
+            if self.__heartbeat == None:
+                self.__heartbeat = threading.Thread(target=self.__renew, name='fst-lease', daemon=True)
+                self.__heartbeat.start()
+        return True
+
+
+    def claim_next(self, files: list):
+        """
+        Claim files one by one
+
+        Parameters
+        ----------
+        files: list
+            Full paths of FST data files
+
+        Returns
+        -------
+        str
+            Yields files leased by this node, every yielded file has to be
+            completed by complete() or given back by release()
+        """
+
+        for source_file in files:
+            if self.claim(source_file):
+                yield source_file
+
+
+    def complete(self, source_file: str, result: dict):
+        """
+        Publish completion record of the file and drop the lease
+
+        Parameters
+        ----------
+        source_file: str
+            Full path to the FST data file
+
+        result: dict
+            Per-file results (json-serializable), merged by the final step, see results()
+        """
+
+        name = os.path.basename(source_file)
+        record = {'file': name, 'node': self.__node, 'completed': time.time(), 'result': result}
+        done_file = self.__done_file(name)
+        tmp_file = '{0}.{1}.tmp'.format(done_file, uuid.uuid4().hex)
+        with open(tmp_file, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp_file, done_file)
+        self.release(source_file)
+
+
+    def release(self, source_file: str):
+        """
+        Give the file back without completion record (e.g. after processing error).
+        The lease is removed only if it still belongs to this node
+        """
+
+        lease_file = self.__lease_file(os.path.basename(source_file))
+        with self.__lock:
+            token = self.__leases.pop(lease_file, None)
+        if token != None:
+            self.__remove_lease(lease_file, token)
+
+
+    def status(self, files: list) -> dict:
+        """
+        Returns
+        -------
+        dict
+            {'done': completed files, 'leased': files being processed, 'waiting': the rest}
+        """
+
+        result = {'done': 0, 'leased': 0, 'waiting': 0}
+        for source_file in files:
+            name = os.path.basename(source_file)
+            if os.path.exists(self.__done_file(name)):
+                result['done'] += 1
+            elif os.path.exists(self.__lease_file(name)):
+                result['leased'] += 1
+            else:
+                result['waiting'] += 1
+        return result
+
+
+    def results(self, files: list) -> list:
+        """
+        Load completion records of the files
+
+        Returns
+        -------
+        list
+            Completion records {'file', 'node', 'completed', 'result'} of the completed files
+        """
+
+        records = list()
+        for source_file in files:
+            done_file = self.__done_file(os.path.basename(source_file))
+            if os.path.exists(done_file):
+                with open(done_file) as f:
+                    records.append(json.load(f))
+        return records
+
+
+    def __reclaim(self, lease_file: str) -> bool:
+        # Returns True if the expired lease was removed
+        try:
+            mtime = os.path.getmtime(lease_file)
+            with open(lease_file) as f:
+                content = f.read()
+        except FileNotFoundError:
+            return True
+        if time.time() - mtime < self.__leaseTimeout:
+            return False
+
+        # Only one node succeeds with rename. If the lease was renewed or replaced
+        # since it was read, it is put back
+        expired_file = '{0}.{1}.expired'.format(lease_file, uuid.uuid4().hex)
+        try:
+            os.rename(lease_file, expired_file)
+        except FileNotFoundError:
+            return True
+        try:
+            with open(expired_file) as f:
+                still_expired = f.read() == content and time.time() - os.path.getmtime(expired_file) >= self.__leaseTimeout
+            if not still_expired:
+                try:
+                    os.link(expired_file, lease_file)
+                except FileExistsError:
+                    pass
+                return False
+            print('!!!!!!! WARNING !!!!!!!\nLease {0} expired and was reclaimed: {1}\n!!!!!!! WARNING !!!!!!!'.format(lease_file, content))
+            return True
+        finally:
+            os.remove(expired_file)
+
+
+    def __renew(self):
+        while True:
+            time.sleep(self.__leaseTimeout / 3)
+            with self.__lock:
+                leases = list(self.__leases.items())
+            for lease_file, token in leases:
+                if self.__owns(lease_file, token):
+                    try:
+                        os.utime(lease_file)
+                    except OSError:
+                        pass
+                    continue
+                # The lease was reclaimed by another node (this node did not renew it
+                # in time), the lease of the new owner is not touched
+                with self.__lock:
+                    if self.__leases.get(lease_file) == token:
+                        del self.__leases[lease_file]
+                print('!!!!!!! WARNING !!!!!!!\nLease {0} of this node was reclaimed by another node\n!!!!!!! WARNING !!!!!!!'.format(lease_file))
+
+
+    def __owns(self, lease_file: str, token: str) -> bool:
+        try:
+            with open(lease_file) as f:
+                return json.load(f).get('token') == token
+        except (FileNotFoundError, ValueError):
+            # Missing or being written by a new owner
+            return False
+
+
+    def __remove_lease(self, lease_file: str, token: str):
+        # The lease is renamed first, so if another node owns it now, it is checked
+        # and put back instead of being removed
+        removed_file = '{0}.{1}.removed'.format(lease_file, uuid.uuid4().hex)
+        try:
+            os.rename(lease_file, removed_file)
+        except FileNotFoundError:
+            return
+        try:
+            if not self.__owns(removed_file, token):
+                try:
+                    os.link(removed_file, lease_file)
+                except FileExistsError:
+                    pass
+        finally:
+            os.remove(removed_file)
+
+
+    def __lease_file(self, name: str) -> str:
+        return os.path.join(self.__directory, name + '.lease')
+
+
+    def __done_file(self, name: str) -> str:
+        return os.path.join(self.__directory, name + '.done.json')
+
+
+def merge_results(records: list) -> dict:
+    """
+    Merge per-file results of completion records into global statistics
+
+    Numbers are summed, dicts are merged recursively, other values are taken
+    from the first record.
+
+    Parameters
+    ----------
+    records: list
+        Completion records, see WorkQueue.results()
+
+    Returns
+    -------
+    dict
+        Merged results with 'files' (number of files) and 'nodes' (sorted node names)
+    """
+
+    merged = dict()
+
+    def merge(target: dict, source: dict):
+        for key, value in source.items():
+            if isinstance(value, dict):
+                merge(target.setdefault(key, dict()), value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                target[key] = target.get(key, 0) + value
+            else:
+                target.setdefault(key, value)
+
+    for record in records:
+        merge(merged, record['result'])
+    merged['files'] = len(records)
+    merged['nodes'] = sorted(set(record['node'] for record in records))
+    return merged
+
+
+if __name__ == '__main__':
+    print('Module work_queue.py is not main application')
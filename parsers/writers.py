@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+This module contains the functions for writing parsed FST data records to the
+decoded text file and to Wireshark pcap-file
+"""
+from parsers.file_parsers import TimeConverter
+from parsers.dict_parsers import search_for_message, search_for_direction
+from parsers.pcap import EncapsulationTable
+
+
+#Used if no TimeConverter is given: FST times in GMT+3
+_defaultTimeConverter = TimeConverter()
+
+
+def write_file_header(out_file, fileInfo: dict):
+    """
+    Write FST file header to the decoded text file
+
+    Parameters
+    ----------
+    out_file:
+        Opened text file (or any object with write())
+
+    fileInfo: dict
+        File header returned by FstParser.open()
+    """
+
+    print('-'*80, file=out_file)
+    print('FILE HEADER', file=out_file)
+    print('\tElement ID: ' + str(fileInfo['ElementId']), file=out_file)
+    print('\tElement Mode: ' + str(fileInfo['ElementMode']), file=out_file)
+    print('\tFile type: ' + str(fileInfo['FileType']), file=out_file)
+    print('\tElement version: '+ fileInfo['ElementVersion'], file=out_file)
+    print('\tFile start timestamp: ' + str(fileInfo['FileStartTimestamp']), file=out_file)
+    print('\tFile end timestamp: ' + str(fileInfo['FileEndTimestamp']), file=out_file)
+    print('\tFile record number: ' + str(fileInfo['FileRecordNumber']), file=out_file)
+    print('\tFile No: ' + str(fileInfo['FileNo']), file=out_file)
+
+
+def write_record_text(out_file, rec: int, record: dict, elementMode: int, dictionaries: dict,
+                      decodeRecordsContent = True, saveMessageRawData = True, timeConverter = None,
+                      payloadTable = None) -> list:
+    """
+    Write one data record to the decoded text file
+
+    Parameters
+    ----------
+    out_file:
+        Opened text file (or any object with write())
+
+    rec: int
+        Number of the data record printed in the header of the record
+
+    record: dict
+        Data record returned by FstParser.readRecords()
+
+    elementMode: int
+        'ElementMode' from the file header (1 - UMTS, 3 - GSM)
+
+    dictionaries: dict
+        Loaded dictionaries: {'messages', 'protocols', 'directions_2g', 'directions_3g'}
+
+    decodeRecordsContent = True, saveMessageRawData = True
+        The same values which were used for FstParser.readRecords()
+
+    timeConverter = None
+        parsers.file_parsers.TimeConverter used for message times
+
+    payloadTable = None
+        parsers.payloads.PayloadTable: repeated raw data is written as reference
+        '@<record>.<message>' to its first occurrence in the file (call
+        reset_references() for every new file)
+
+    Returns
+    -------
+    list
+        Names for message/procedure/protocol of every message of the record,
+        see search_for_message()
+    """
+
+    if timeConverter == None:
+        timeConverter = _defaultTimeConverter
+    msgs = list()
+    print('\nDATA RECORD ' + str(rec), file=out_file)
+    print('\tRecord length: ' + str(record['recordLength']), file=out_file)
+    print('\t\tRecord Header: ', file=out_file)
+    print('\t\t\tUE ID Info: ', file=out_file)
+    print('\t\t\t\tGlobal Call ID: ' + str(record['recordHeader']['ueIdInfo']['GlobalCallId']), file=out_file)
+    print('\t\t\t\tIMSI Information: ', file=out_file)
+    print('\t\t\t\t\tIMSI Length: ' + str(record['recordHeader']['ueIdInfo']['ImsiLength']), file=out_file)
+    print('\t\t\t\t\tAccess Cell ID: ' + str(record['recordHeader']['ueIdInfo']['AccessCellId']), file=out_file)
+    print('\t\t\t\t\tIMSI Element: ' + str(record['recordHeader']['ueIdInfo']['ImsiElement']), file=out_file)
+    print('\t\t\tSource ID: ' + str(record['recordHeader']['SourceId']), file=out_file)
+    print('\t\t\tRecord type: ' + str(record['recordHeader']['RecordType']), file=out_file)
+    print('\t\t\tRecord TLV data length: ' + str(record['recordHeader']['RecordTlvDataLength']), file=out_file)
+    if record['recordHeader']['RecordTlvDataLength'] > 0:
+        print('\t\t\tRecord TLV data: ' + record['recordTlvData'], file=out_file)
+    print('\t\t\tMessage count: ' + str(record['recordHeader']['MessageCount']), file=out_file)
+    print('\t\t\tRecord content length: ' + str(record['recordHeader']['RecordContentLength']), file=out_file)
+    print('\t\t\tRecord sequence: ' + str(record['recordHeader']['RecordSequence']), file=out_file)
+
+    if decodeRecordsContent:
+        for m, message in enumerate(record['recordContent']):
+            msg = search_for_message(dictionaries['messages'], dictionaries['protocols'], message['header']['protocolType'],
+                                    message['header']['procedureType'], message['header']['messageType'])
+            msgs.append(msg)
+
+            print('\t\t\t\tMessage: ', file=out_file)
+            print('\t\t\t\t\tMessage header: ', file=out_file)
+            print('\t\t\t\t\t\tProtocol type: ' + str(message['header']['protocolType']) + ' ' + msg['protocolName'], file=out_file)
+            print('\t\t\t\t\t\tProcedure type: ' + str(message['header']['procedureType'])  + ' ' + msg['procedureName'], file=out_file)
+            print('\t\t\t\t\t\tMessage type: ' + str(message['header']['messageType'])   + ' ' + msg['messageName'], file=out_file)
+            if elementMode == 3:   # 3 - GSM
+                print('\t\t\t\t\t\tDirection: ' + str(message['header']['direction']) + ' ' + search_for_direction(dictionaries['directions_2g'], message['header']['direction']), file=out_file)
+            elif elementMode == 1: # 1 - UMTS
+                print('\t\t\t\t\t\tDirection: ' + str(message['header']['direction']) + ' ' + search_for_direction(dictionaries['directions_3g'], message['header']['direction']), file=out_file)
+            print('\t\t\t\t\t\tSecond: ' + timeConverter.toText(message['header']['second'], message['header']['quatMillisecond']), file=out_file)  #01.01.2000
+            print('\t\t\t\t\t\tService Cell ID: ' + str(message['header']['serviceCellId']), file=out_file)
+            print('\t\t\t\t\t\tMessage TLV data length: ' + str(message['header']['messageTlvDataLength']), file=out_file)
+            if message['header']['messageTlvDataLength'] > 0:
+                print('\t\t\t\t\t\tMessage TLV data: ' + message['tlvData'], file=out_file)
+            print('\t\t\t\t\t\tMessage sequence: ' + str(message['header']['messageSequence']), file=out_file)
+            print('\t\t\t\t\t\tRaw data length: ' + str(message['header']['rawDataLength']), file=out_file)
+            if saveMessageRawData:
+                if payloadTable != None:
+                    print('\t\t\t\t\t\tRaw data: ' + payloadTable.reference(message['rawData'], rec, m), file=out_file)
+                else:
+                    print('\t\t\t\t\t\tRaw data: ' + message['rawData'], file=out_file)
+    else:
+        print('\t\t\tRecord Raw data: ' + record['recordRawContent'], file=out_file)
+    print('-'*80, file=out_file)
+
+    return msgs
+
+
+def write_record_pcap(p, record: dict, encapsulations, timeConverter = None):
+    """
+    Write all messages of one data record to the opened pcap-file
+
+    Parameters
+    ----------
+    p: parsers.pcap.Pcap
+        Opened Pcap object
+
+    record: dict
+        Data record returned by FstParser.readRecords() with decoded content and raw data
+
+    encapsulations: parsers.pcap.EncapsulationTable
+        Dispatch table compiled once from the pcap dictionary (protocols_pcap.json).
+        The loaded dictionary (list) is also accepted, but then it is compiled for every call
+
+    timeConverter = None
+        parsers.file_parsers.TimeConverter with the time zone of the FST file
+
+    Raises PcapMappingError for a message which has no encapsulation in the dictionary
+    """
+
+    if timeConverter == None:
+        timeConverter = _defaultTimeConverter
+    if isinstance(encapsulations, list):
+        encapsulations = EncapsulationTable(encapsulations)
+
+    for message in record['recordContent']:
+        header = message['header']
+        if header['protocolType'] == 100:   # Vendor messages are not saved
+            continue
+        encapsulation = encapsulations.lookup(header['protocolType'], header['direction'],
+                                              header['procedureType'], header['messageType'])
+        sec, usec = timeConverter.toPcapTime(header['second'], header['quatMillisecond'])
+        p.write_encapsulated(encapsulation, bytes.fromhex(message['rawData']), sec, usec)
+
+
+if __name__ == '__main__':
+    print('Module writers.py is not main application')
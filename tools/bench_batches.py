@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark of parser_umts_gsm(): peak memory (tracemalloc) of reading a
+whole file (batchSize=0) and of the batched mode for synthetic files of two
+sizes. The batched mode has to keep the same peak for the larger file.
+
+Usage: bench_batches.py [records] [batchSize ...]
+"""
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parsers.file_parsers import parser_umts_gsm
+from tools.gen_fst import generate
+
+
+def measure(file: str, batchSize: int) -> tuple:
+    """
+    Returns
+    -------
+    tuple
+        (records, peak memory in bytes, seconds)
+    """
+
+    tracemalloc.start()
+    t = time.time()
+    count = 0
+    result = parser_umts_gsm(file, batchSize=batchSize)
+    if batchSize == 0:
+        count = len(result['dataRecords'])
+    else:
+        for batch in result['dataRecords']:
+            count += len(batch)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, peak, time.time() - t
+
+
+if __name__ == '__main__':
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    batchSizes = [int(x) for x in sys.argv[2:]] or [0, 1000, 100]
+
+    peaks = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        for n in (records, 2 * records):
+            file = os.path.join(directory, 'ZTE_FST_UMTS_{0}.dat'.format(n))
+            generate(file, n)
+            for batchSize in batchSizes:
+                count, peak, seconds = measure(file, batchSize)
+                peaks[(n, batchSize)] = peak
+                print('records={0:7} size={1:5.1f} MB batchSize={2:5} peak={3:7.1f} MB time={4:.2f}s'.format(
+                    count, os.path.getsize(file) / 2**20, batchSize, peak / 2**20, seconds))
+
+    # Batched peak must not grow with the file size (small tolerance for allocator noise)
+    failed = [batchSize for batchSize in batchSizes
+              if batchSize > 0 and peaks[(2 * records, batchSize)] > 1.2 * peaks[(records, batchSize)] + 2**20]
+    if len(failed) > 0:
+        print('FAILED: peak memory grows with the file size for batchSize ' + ', '.join(str(b) for b in failed))
+        exit(1)
+    print('OK: peak memory of the batched mode does not depend on the file size')
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Throughput/size benchmark of compressed outputs (parsers.compress): a
+synthetic file is decoded to text as fst_parser.py does it, without
+compression and with every available compression. 'compress only' is the
+time of compressing the uncompressed output alone, 'hidden' is
+the part of it which overlapped decoding in the background thread (needs
+more than one core).
+
+Usage: bench_compress.py [records] [level]
+"""
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parsers.file_parsers import FstParser, TimeConverter
+from parsers.dict_parsers import load_dictionary_csv, load_dictionary_json
+from parsers.writers import write_file_header, write_record_text
+from parsers.compress import open_output, output_name, available_compressions
+from tools.gen_fst import generate
+
+
+def decode(file: str, decoded_file: str, compression, level, dictionaries: dict, timeConverter) -> float:
+    t = time.time()
+    fstParser = FstParser()
+    fileInfo = fstParser.open(file)
+    with open_output(decoded_file, compression, text=True, level=level) as out_file:
+        write_file_header(out_file, fileInfo)
+        for rec, record in enumerate(fstParser.readRecords(True, True, [])):
+            write_record_text(out_file, rec, record, fileInfo['ElementMode'], dictionaries, True, True, timeConverter)
+    fstParser.close()
+    return time.time() - t
+
+
+def compress_only(file: str, compressed_file: str, compression, level, chunkSize = 1 << 20) -> float:
+    #Nothing to overlap with, close() waits for the background thread
+    t = time.time()
+    with open(file, 'rb') as f, open_output(compressed_file, compression, level=level) as out_file:
+        for chunk in iter(lambda: f.read(chunkSize), b''):
+            out_file.write(chunk)
+    return time.time() - t
+
+
+if __name__ == '__main__':
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    level = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    dictionaries = {'messages': load_dictionary_csv(os.path.join(root, 'dicts', 'messages.csv'), ['protocolType','procedureType','messageType']),
+                    'protocols': load_dictionary_json(os.path.join(root, 'dicts', 'protocols.json')),
+                    'directions_2g': load_dictionary_csv(os.path.join(root, 'dicts', 'directions_2g.csv'), ['id']),
+                    'directions_3g': load_dictionary_csv(os.path.join(root, 'dicts', 'directions_3g.csv'), ['id'])}
+    timeConverter = TimeConverter(10800)
+
+    with tempfile.TemporaryDirectory() as directory:
+        file = os.path.join(directory, 'ZTE_FST_UMTS_bench.dat')
+        generate(file, records)
+        print('{0} records, input {1:.1f} MB, {2} cores, level {3}'.format(records, os.path.getsize(file) / 2**20, os.cpu_count(),
+                                                                           'default' if level == None else level))
+        print('compression   time     size      compress only  hidden')
+        plain_file = os.path.join(directory, 'plain.decoded.txt')
+        plain = decode(file, plain_file, None, None, dictionaries, timeConverter)
+        print('{0:10} {1:6.2f} s {2:7.1f} MB'.format('none', plain, os.path.getsize(plain_file) / 2**20))
+        for compression in available_compressions():
+            decoded_file = os.path.join(directory, compression + '.decoded.txt')
+            seconds = decode(file, decoded_file, compression, level, dictionaries, timeConverter)
+            alone = compress_only(plain_file, os.path.join(directory, compression + '.only'), compression, level)
+            print('{0:10} {1:6.2f} s {2:7.1f} MB   {3:6.2f} s      {4:5.2f} s'.format(compression, seconds,
+                    os.path.getsize(output_name(decoded_file, compression)) / 2**20, alone, max(0, plain + alone - seconds)))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Generator of synthetic ZTE FST UMTS files for local checks and benchmarks
+
+Every third record of a GlobalCallId starts with UE Start and every third
+ends with UE End, messages are UU/NBAP/RANAP/RNSAP with random payloads
+(BCCH FACH payloads are identical)
+
+Usage: gen_fst.py <file> <records> [seed]
+"""
+import sys
+import random
+import struct
+
+
+# (protocolType, procedureType, messageType, direction) present in dicts/protocols_pcap.json
+MESSAGES = [
+    (101, 2, 1, 9), (101, 3, 1, 9), (101, 0, 1, 10), (101, 1, 1, 10), (101, 4, 1, 10), (101, 5, 1, 10),
+    (102, 0, 1, 3), (102, 0, 2, 4),
+    (103, 0, 1, 5), (103, 0, 2, 6),
+    (104, 0, 1, 7), (104, 0, 2, 8),
+]
+BCCH_FACH = bytes.fromhex('00112233445566778899aabbccddeeff' * 4)
+
+
+def imsi_to_bytes(imsi: str) -> bytes:
+    digits = [int(c, 16) for c in imsi]
+    result = [digits[0] << 4 | 0x9]
+    for i in range(1, 15, 2):
+        result.append(digits[i] | (digits[i + 1] << 4))
+    return bytes(result)
+
+
+def make_record(rnd, imsi: str, globalCallId: int, sequence: int, second: int, ueStart = False, ueEnd = False) -> bytes:
+    items = list()
+    if ueStart:
+        items.append((100, 0, 0, 31))
+    items += [rnd.choice(MESSAGES) for i in range(rnd.randint(1, 8))]
+    if ueEnd:
+        items.append((100, 0, 1, 31))
+
+    messages = list()
+    for k, (protocolType, procedureType, messageType, direction) in enumerate(items):
+        if protocolType == 100:
+            raw = b''
+        elif protocolType == 101 and procedureType == 4:
+            raw = BCCH_FACH
+        else:
+            raw = bytes(rnd.getrandbits(8) for i in range(rnd.randint(10, 120)))
+        messages.append(struct.pack('=BBBBLHBBHH', protocolType, procedureType, messageType, direction, second + k // 3,
+                                    1000 + globalCallId % 7, rnd.randint(0, 249), 0, k, len(raw)) + raw)
+    content = b''.join(messages)
+    header = struct.pack('=HQB', 34 + len(content), globalCallId, 8) + b'\0' + struct.pack('=H8s', 500 + globalCallId % 5, imsi_to_bytes(imsi))
+    header += struct.pack('=LBBHHH', 77, 1, 0, len(items), len(content), sequence % 65536)
+    return header + content + b'\xfe\xef'
+
+
+def generate(file: str, records: int, seed = 1, startSecond = 590000000):
+    rnd = random.Random(seed)
+    imsis = ['25501{0:010d}'.format(i) for i in range(max(1, records // 20))]
+    with open(file, 'wb') as f:
+        f.write(struct.pack('=HBB32sLLLL', 116, 1, 1, b'V6.50.310', startSecond, startSecond + records // 10, records, 315) + b'\0' * 28)
+        for i in range(records):
+            f.write(make_record(rnd, rnd.choice(imsis), 1000 + i // 3, i, startSecond + i // 10,
+                                ueStart=(i % 3 == 0), ueEnd=(i % 3 == 2)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__)
+        exit(1)
+    generate(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 1)
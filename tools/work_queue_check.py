@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Local check of parsers.work_queue.WorkQueue with several processes sharing
+one queue directory (the same code path as nodes on shared storage):
+
+    - every file is completed exactly once by one of the workers
+    - a lease of a dead node (not renewed for leaseTimeout) is reclaimed
+    - a node whose lease was reclaimed neither renews nor removes the lease
+      of the new owner
+
+Usage: work_queue_check.py [workers] [files]
+"""
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parsers.work_queue import WorkQueue, merge_results
+
+
+LEASE_TIMEOUT = 1.5
+
+
+def worker(directory: str, files: list, log_file: str):
+    queue = WorkQueue(directory, LEASE_TIMEOUT, node='worker-{0}'.format(os.getpid()))
+    rnd = random.Random(os.getpid())
+    for source_file in queue.claim_next(files):
+        time.sleep(rnd.uniform(0.05, 0.3))
+        # O_APPEND writes of one line are atomic, every completion is logged
+        with open(log_file, 'a') as f:
+            f.write(os.path.basename(source_file) + '\n')
+        queue.complete(source_file, {'records': 100, 'bytes': 1000})
+
+
+def check_processes(directory: str, workers: int, count: int) -> list:
+    errors = list()
+    files = ['/share/traces/ZTE_FST_UMTS_{0:03d}.dat'.format(i) for i in range(count)]
+    log_file = os.path.join(directory, 'completions.log')
+    queue_directory = os.path.join(directory, 'queue')
+    os.makedirs(queue_directory)
+
+    # Lease of a dead node, not renewed for 2 hours
+    stale = os.path.join(queue_directory, os.path.basename(files[0]) + '.lease')
+    with open(stale, 'w') as f:
+        json.dump({'node': 'dead-node', 'token': 'dead', 'claimed': time.time() - 7200}, f)
+    os.utime(stale, (time.time() - 7200, time.time() - 7200))
+
+    processes = [multiprocessing.Process(target=worker, args=(queue_directory, files, log_file)) for i in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        if process.exitcode != 0:
+            errors.append('worker exited with code {0}'.format(process.exitcode))
+
+    with open(log_file) as f:
+        completed = f.read().split()
+    for source_file in files:
+        name = os.path.basename(source_file)
+        if completed.count(name) != 1:
+            errors.append('{0} completed {1} times'.format(name, completed.count(name)))
+    queue = WorkQueue(queue_directory, LEASE_TIMEOUT)
+    status = queue.status(files)
+    if status != {'done': count, 'leased': 0, 'waiting': 0}:
+        errors.append('status after all workers: {0}'.format(status))
+    leftovers = [name for name in os.listdir(queue_directory) if not name.endswith('.done.json')]
+    if len(leftovers) > 0:
+        errors.append('files left in the queue directory: {0}'.format(leftovers))
+    merged = merge_results(queue.results(files))
+    if merged['files'] != count or merged['records'] != 100 * count:
+        errors.append('merged results: {0}'.format(merged))
+    print('{0} workers, {1} files: status {2}, nodes {3}'.format(workers, count, status, len(merged['nodes'])))
+    return errors
+
+
+def check_reclaimed_lease(directory: str) -> list:
+    errors = list()
+    queue_directory = os.path.join(directory, 'reclaimed')
+    source_file = '/share/traces/ZTE_FST_UMTS_reclaimed.dat'
+    lease_file = os.path.join(queue_directory, os.path.basename(source_file) + '.lease')
+    old = WorkQueue(queue_directory, LEASE_TIMEOUT, node='old-owner')
+    if not old.claim(source_file):
+        return ['the file was not claimed']
+
+    # Another node reclaimed the lease while the old owner was stalled. The new
+    # owner does not renew it, so renewing by the old owner would be visible
+    tmp_file = lease_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({'node': 'new-owner', 'token': 'new', 'claimed': time.time()}, f)
+    os.replace(tmp_file, lease_file)
+    mtime = time.time() - 3600
+    os.utime(lease_file, (mtime, mtime))
+
+    time.sleep(LEASE_TIMEOUT)   # renewal runs every LEASE_TIMEOUT / 3
+    if os.path.getmtime(lease_file) != mtime:
+        errors.append('the old owner renewed the lease of the new owner')
+    old.complete(source_file, {'records': 1})
+    if not os.path.exists(lease_file):
+        errors.append('the old owner removed the lease of the new owner')
+    else:
+        with open(lease_file) as f:
+            if json.load(f)['token'] != 'new':
+                errors.append('the lease of the new owner was changed')
+    leftovers = [name for name in os.listdir(queue_directory) if name.endswith(('.removed', '.expired', '.tmp'))]
+    if len(leftovers) > 0:
+        errors.append('files left in the queue directory: {0}'.format(leftovers))
+    print('reclaimed lease: {0} error(s)'.format(len(errors)))
+    return errors
+
+
+if __name__ == '__main__':
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 24
+
+    with tempfile.TemporaryDirectory() as directory:
+        errors = check_processes(directory, workers, count) + check_reclaimed_lease(directory)
+    if len(errors) > 0:
+        print('FAILED:\n\t' + '\n\t'.join(errors))
+        exit(1)
+    print('OK')